@@ -0,0 +1,388 @@
+from multiprocessing.pool import ThreadPool
+from utils import file_digest, replace_file, save_json
+from collections import deque
+import binascii
+import bz2
+import hashlib
+import os
+import struct
+import tarfile
+import time
+import zipfile
+
+try:
+    import zlib
+except ImportError:
+    zlib = None
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+
+READ_SIZE = 1024 * 1024
+LOCAL_HEADER = struct.Struct('<4s2B4HL2L2H')
+LOCAL_HEADER_SIGNATURE = 'PK\003\004'
+
+ZIP_BZIP2 = 12
+ZIP_LZMA = 14
+LZMA_EOS_FLAG = 0x02
+
+# liblzma's defaults: the lc, lp and pb bits and the dictionary size of every preset.
+LZMA_LITERAL_BITS = (3, 0, 2)
+LZMA_DICT_SIZES = [1 << 18, 1 << 20, 1 << 21, 1 << 22, 1 << 22, 1 << 23, 1 << 23, 1 << 24, 1 << 25, 1 << 26]
+
+# Compression method and the zip version needed to extract it.
+ZIP_METHODS = {
+    'stored': (zipfile.ZIP_STORED, 20),
+    'deflate': (zipfile.ZIP_DEFLATED, 20),
+    'bzip2': (ZIP_BZIP2, 46),
+    'lzma': (ZIP_LZMA, 63)
+}
+
+TAR_MODES = {
+    'tar.gz': 'w:gz',
+    'tar.bz2': 'w:bz2',
+    'tar.xz': 'w'
+}
+
+# Formats that are compressed already, deflating them again costs time and saves nothing.
+STORED_EXTENSIONS = set([
+    '.png', '.jpg', '.jpeg', '.gif', '.webp', '.ico',
+    '.woff', '.woff2', '.eot',
+    '.mp3', '.mp4', '.m4a', '.m4v', '.ogg', '.oga', '.ogv', '.webm', '.mov',
+    '.zip', '.gz', '.tgz', '.bz2', '.xz', '.7z', '.rar', '.jar'
+])
+
+
+def _read(path):
+    f = open(path, 'rb')
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+
+def available(method):
+    if method == 'deflate':
+        return zlib is not None
+    elif method == 'lzma' or method == 'tar.xz':
+        return lzma is not None
+
+    return True
+
+
+def _lzma_compress(data, level):
+    # The zip flavour of lzma: a small header with the raw LZMA1 properties, then the raw stream.
+    # The properties are set explicitly, so the header describes exactly what the compressor uses.
+    preset = 6 if level is None else level
+    lc, lp, pb = LZMA_LITERAL_BITS
+    dict_size = LZMA_DICT_SIZES[preset]
+
+    properties = struct.pack('<BL', (pb * 5 + lp) * 9 + lc, dict_size)
+    compressor = lzma.LZMACompressor(lzma.FORMAT_RAW, filters=[{'id': lzma.FILTER_LZMA1, 'preset': preset, 'dict_size': dict_size, 'lc': lc, 'lp': lp, 'pb': pb}])
+
+    return struct.pack('<BBH', 9, 4, len(properties)) + properties + compressor.compress(data) + compressor.flush()
+
+
+def _compress(job):
+    # zlib, bz2 and lzma release the interpreter lock while they compress, so threads run this in parallel.
+    path, method, level, previous_crc = job
+    data = _read(path)
+    digest = hashlib.sha256(data).hexdigest()
+
+    crc = binascii.crc32(data) & 0xffffffff
+    if crc == previous_crc:
+        return (digest, None)
+
+    if method == 'bzip2':
+        compressed = bz2.compress(data, 9 if level is None else max(level, 1))
+    elif method == 'lzma':
+        compressed = _lzma_compress(data, level)
+    else:
+        compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION if level is None else level, zlib.DEFLATED, -15)
+        compressed = compressor.compress(data) + compressor.flush()
+
+    if len(compressed) >= len(data):
+        return (digest, (zipfile.ZIP_STORED, crc, len(data), data))
+
+    return (digest, (ZIP_METHODS[method][0], crc, len(data), compressed))
+
+
+class ZipArchive(object):
+    def __init__(self, dest, jobs=1, method='deflate', level=None):
+        self._dest = dest
+        self._tmp_dest = dest + '.tmp'
+        self._jobs = jobs
+        self._level = level
+
+        self._method = method
+        if self._method != 'stored' and (not available(self._method) or self._level == 0):
+            self._method = 'stored'
+
+        self._previous = None
+        self._previous_entries = {}
+        self._digests = []
+
+        self._zip = zipfile.ZipFile(self._tmp_dest, 'w', zipfile.ZIP_STORED, allowZip64=True)
+        self._zip.comment = self._signature()
+
+    def _signature(self):
+        # Kept in the archive comment, entries are only reused from an archive made with the same settings.
+        return 'grace:%s:%s' % (self._method, self._level)
+
+    def reuse(self, path):
+        # Entries of an earlier archive whose file did not change are copied over as they are.
+        try:
+            previous = zipfile.ZipFile(path, 'r')
+        except (IOError, OSError, zipfile.BadZipfile):
+            return
+
+        if previous.comment != self._signature():
+            previous.close()
+            return
+
+        self._previous = previous
+        for info in previous.infolist():
+            if info.flag_bits & 0x1 == 0 and info.compress_type in (zipfile.ZIP_STORED, ZIP_METHODS[self._method][0]):
+                self._previous_entries[info.filename] = info
+
+    def _reusable(self, info):
+        previous = self._previous_entries.get(info.filename)
+        if previous is None or previous.file_size != info.file_size:
+            return None
+
+        # Zip timestamps only have a resolution of two seconds.
+        if previous.date_time[:5] != info.date_time[:5] or previous.date_time[5] // 2 != info.date_time[5] // 2:
+            return None
+
+        return previous
+
+    def _zip_info(self, path, arcname):
+        stat = os.stat(path)
+        info = zipfile.ZipInfo(arcname, time.localtime(stat.st_mtime)[0:6])
+        info.external_attr = (stat.st_mode & 0xFFFF) << 16
+        info.file_size = stat.st_size
+
+        return info
+
+    def _start_entry(self, info, compress_type, flag_bits=0):
+        info.compress_type = compress_type
+        info.flag_bits = flag_bits
+        if compress_type == ZIP_LZMA:
+            info.flag_bits |= LZMA_EOS_FLAG
+
+        for method, version in ZIP_METHODS.values():
+            if method == compress_type:
+                info.extract_version = max(info.extract_version, version)
+                info.create_version = max(info.create_version, version)
+
+        info.header_offset = self._zip.fp.tell()
+
+        # zipfile refuses the methods it can not write itself, the data is already compressed here.
+        if compress_type in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+            self._zip._writecheck(info)
+        self._zip._didModify = True
+
+    def _write_entry(self, info, compress_type, crc, file_size, data):
+        info.CRC = crc
+        info.file_size = file_size
+        info.compress_size = len(data)
+
+        self._start_entry(info, compress_type)
+
+        self._zip.fp.write(info.FileHeader(file_size > zipfile.ZIP64_LIMIT))
+        self._zip.fp.write(data)
+        self._zip.filelist.append(info)
+        self._zip.NameToInfo[info.filename] = info
+
+    def _copy_entry(self, info, previous):
+        fp = self._previous.fp
+        fp.seek(previous.header_offset)
+        data = fp.read(LOCAL_HEADER.size)
+        if len(data) != LOCAL_HEADER.size or not data.startswith(LOCAL_HEADER_SIGNATURE):
+            return False
+
+        header = LOCAL_HEADER.unpack(data)
+
+        fp.seek(previous.header_offset + LOCAL_HEADER.size + header[-2] + header[-1])
+
+        info.CRC = previous.CRC
+        info.file_size = previous.file_size
+        info.compress_size = previous.compress_size
+
+        self._start_entry(info, previous.compress_type)
+
+        self._zip.fp.write(info.FileHeader(info.file_size > zipfile.ZIP64_LIMIT))
+
+        remaining = previous.compress_size
+        while remaining > 0:
+            block = fp.read(min(remaining, READ_SIZE))
+            if not block:
+                raise zipfile.BadZipfile('The previous archive is truncated.')
+
+            self._zip.fp.write(block)
+            remaining -= len(block)
+
+        self._zip.filelist.append(info)
+        self._zip.NameToInfo[info.filename] = info
+
+        return True
+
+    def _write_stored(self, info, path):
+        # Streamed like ZipFile.write, the header is written again once the CRC is known.
+        info.file_size = os.path.getsize(path)
+        info.compress_size = info.file_size
+        info.CRC = 0
+
+        self._start_entry(info, zipfile.ZIP_STORED)
+
+        zip64 = info.file_size > zipfile.ZIP64_LIMIT
+        self._zip.fp.write(info.FileHeader(zip64))
+
+        crc = 0
+        size = 0
+        h = hashlib.sha256()
+        f = open(path, 'rb')
+        try:
+            for block in iter(lambda: f.read(READ_SIZE), ''):
+                crc = binascii.crc32(block, crc) & 0xffffffff
+                h.update(block)
+                size += len(block)
+                self._zip.fp.write(block)
+        finally:
+            f.close()
+
+        info.CRC = crc
+        info.file_size = size
+        info.compress_size = size
+
+        position = self._zip.fp.tell()
+        self._zip.fp.seek(info.header_offset)
+        self._zip.fp.write(info.FileHeader(zip64))
+        self._zip.fp.seek(position)
+
+        self._zip.filelist.append(info)
+        self._zip.NameToInfo[info.filename] = info
+
+        return h.hexdigest()
+
+    def _is_stored(self, path):
+        return self._method == 'stored' or os.path.splitext(path)[1].lower() in STORED_EXTENSIONS
+
+    def add_files(self, files):
+        if self._jobs > 1:
+            pool = ThreadPool(self._jobs)
+        else:
+            pool = None
+
+        # Only a few files are compressed ahead of the writer, so large archives do not end up in memory.
+        pending = deque()
+        try:
+            for path, arcname in files:
+                info = self._zip_info(path, arcname)
+
+                previous = self._reusable(info)
+                job = (path, self._method, self._level, previous.CRC if previous is not None else None)
+
+                if self._is_stored(path):
+                    result = False
+                elif pool is None:
+                    result = _compress(job)
+                else:
+                    result = pool.apply_async(_compress, (job,))
+
+                pending.append((info, path, previous, result))
+
+                while len(pending) > self._jobs * 2 or (pool is None and len(pending) > 0):
+                    self._write_pending(pending.popleft())
+
+            while len(pending) > 0:
+                self._write_pending(pending.popleft())
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+    def _write_pending(self, entry):
+        info, path, previous, result = entry
+
+        if result is False:
+            self._digests.append((info.filename, self._write_stored(info, path), info.file_size))
+            return
+
+        if not isinstance(result, tuple):
+            result = result.get(365 * 24 * 3600)
+
+        digest, entry = result
+        if entry is None and not self._copy_entry(info, previous):
+            digest, entry = _compress((path, self._method, self._level, None))
+
+        if entry is not None:
+            self._write_entry(info, *entry)
+
+        self._digests.append((info.filename, digest, info.file_size))
+
+    def _close_previous(self):
+        if self._previous is not None:
+            self._previous.close()
+            self._previous = None
+
+    def close(self):
+        self._close_previous()
+        self._zip.close()
+        replace_file(self._tmp_dest, self._dest)
+        self._write_manifest()
+
+    def _write_manifest(self):
+        # The content digests of the archive and its entries, the upload uses them to skip what the server has.
+        stat = os.stat(self._dest)
+        save_json(manifest_path(self._dest), {
+            'digest': file_digest(self._dest, 'sha256'),
+            'size': stat.st_size,
+            'mtime': int(stat.st_mtime),
+            'files': self._digests
+        })
+
+    def abort(self):
+        self._close_previous()
+        try:
+            self._zip.close()
+        finally:
+            if os.path.exists(self._tmp_dest):
+                os.remove(self._tmp_dest)
+
+
+def manifest_path(path):
+    return path + '.manifest.json'
+
+
+def write_tar(dest, files, format='tar.gz', level=None):
+    tmp_dest = dest + '.tmp'
+
+    if format == 'tar.xz':
+        level = 6 if level is None else level
+        fileobj = lzma.LZMAFile(tmp_dest, 'w', preset=level)
+        archive = tarfile.open(mode=TAR_MODES[format], fileobj=fileobj)
+    else:
+        fileobj = None
+        archive = tarfile.open(tmp_dest, TAR_MODES[format], compresslevel=9 if level is None else max(level, 1))
+
+    try:
+        try:
+            for path, arcname in files:
+                archive.add(path, arcname, recursive=False)
+        finally:
+            archive.close()
+            if fileobj is not None:
+                fileobj.close()
+    except:
+        if os.path.exists(tmp_dest):
+            os.remove(tmp_dest)
+        raise
+
+    replace_file(tmp_dest, dest)
@@ -1,34 +1,92 @@
 import os
-from error import FileNotFoundError, CreateFolderError, FileNotWritableError, FileNotReadableError, RemoveFolderError, RemoveFileError, SassError
-from shutil import copy2, copytree, rmtree
-from slimit import minify
-from cssmin import cssmin
-import re
-import scss
+from error import FileNotFoundError, CreateFolderError, FileNotWritableError, RemoveFolderError, RemoveFileError, SassError, JavaScriptError
+from shutil import copy2, rmtree
+from requiregraph import RequireGraph
+from sourcemap import SourceMap, compose_marked, minify_bundle, minify_modules
+from minifycache import MinifyCache, tool_version
+from manifest import BuildManifest, stamp_files, stamp_tree
+from utils import replace_file, load_json, save_json, file_digest
+from fingerprint import content_digest, css_references, fingerprinted_files, fingerprinted_name, is_fingerprinted, read_text, remove_fingerprints, rewrite_css, rewrite_html
+from sync import ensure_folder, remove_stale, sync_file, sync_tree
+from style import StyleCache, compile_styles, create_scss_compiler
+from scheduler import StageScheduler
 import sys
-import tempfile
+import threading
 
 
 class Build(object):
     def __init__(self, config):
         self._cwd = os.getcwd()
         self._config = config
+        self._require_graph = None
+        self._source_map = None
+        self._minify_cache = None
+        self._manifest = None
+        self._scss_compiler = None
+        self._style_cache = None
+        self._lock = threading.Lock()
 
     def run(self):
+        self.run_stages(None)
+
+    def run_stages(self, stages):
         if not os.path.exists(self._config['build_path']):
             try:
                 os.makedirs(self._config['build_path'])
             except:
                 raise CreateFolderError('Could not create the project folder.')
 
+        if not self._config['incremental']:
+            self._manifest = None
+        elif self._manifest is None:
+            self._manifest = BuildManifest(os.path.join(self._cwd, 'build', '.cache', 'manifest_' + self._config['name'] + '.json'))
+
+        scheduler = StageScheduler(self._stages(), self._config['jobs'])
         try:
-            self._build_javascript()
-            self._build_style()
-            self._build_html()
-            self._build_libraries()
-            self._copy_assets()
-        except:
-            raise
+            times = scheduler.run(stages)
+        finally:
+            self._save_manifest()
+            self._prune_minify_cache()
+
+        if self._config['show_times'] and len(times) > 0:
+            print 'Stage times: ' + scheduler.format_times(times)
+
+    def _stages(self):
+        # (name, function, dependencies), the stages without a dependency on
+        # each other write to separate folders and run at the same time.
+        return [
+            ('javascript', self._build_javascript, []),
+            ('style', self._build_style, []),
+            ('libraries', self._build_libraries, []),
+            ('assets', self._copy_assets, []),
+            ('fingerprint', self._fingerprint, ['javascript', 'style', 'libraries', 'assets']),
+            ('html', self._build_html, ['fingerprint'])
+        ]
+
+    def _stage_is_current(self, stage, settings, inputs=None):
+        if self._manifest is None:
+            return False
+
+        if self._manifest.is_current(stage, settings, inputs):
+            return True
+
+        self._manifest.invalidate(stage)
+        return False
+
+    def _record_stage(self, stage, settings, inputs, outputs):
+        if self._manifest is None:
+            return
+
+        self._manifest.update(stage, settings, inputs, outputs)
+
+    def _save_manifest(self):
+        if self._manifest is None:
+            return
+
+        try:
+            self._manifest.save()
+        except (IOError, OSError):
+            print 'Could not write the build manifest.'
 
     def _build_javascript(self):
         js_name = self._config['js_name'] + '.js'
@@ -40,91 +98,257 @@ class Build(object):
             if not os.path.exists(source):
                 return
 
+        settings = {
+            'source': os.path.basename(source),
+            'version': self._config['version'],
+            'minify_js': self._config['minify_js'],
+            'minify_js_per_module': self._config['minify_js_per_module'],
+            'source_map': self._config['source_map']
+        }
+        if self._stage_is_current('javascript', settings):
+            return
+
+        if self._config['source_map']:
+            # The sources are relative to the project, the map is read relative to the build folder.
+            source_root = os.path.relpath(self._cwd, self._config['build_path']).replace(os.sep, '/') + '/'
+            self._source_map = SourceMap(js_name, source_root)
+        else:
+            self._source_map = None
+
+        tmp_dest = dest + '.tmp'
+        try:
+            f = open(tmp_dest, 'w+')
+        except:
+            raise FileNotWritableError('Could not write the javascript file.')
+
         try:
-            self._js_string = self._concat_javascript(source)
+            if self._config['minify_js'] and self._config['minify_js_per_module']:
+                chunks = self._minify_javascript_modules(source, js_name)
+            elif self._config['minify_js']:
+                text = ''.join(self._concat_javascript(source))
+                if self._source_map is not None:
+                    marked = self._cached_minify('js-marked', text, lambda: minify_bundle(text, True))
+                    minified, self._source_map = compose_marked(marked, text, self._source_map)
+                    chunks = [minified]
+                else:
+                    chunks = [self._cached_minify('js', text, lambda: minify_bundle(text, False))]
+            else:
+                chunks = self._concat_javascript(source)
+
+            for chunk in chunks:
+                f.write(chunk.encode('utf-8'))
+
+            if self._source_map is not None:
+                f.write('\n//# sourceMappingURL=' + js_name.encode('utf-8') + '.map\n')
+                self._source_map.save(tmp_dest + '.map')
         except:
+            f.close()
+            os.remove(tmp_dest)
+            if os.path.exists(tmp_dest + '.map'):
+                os.remove(tmp_dest + '.map')
             raise
 
-        if os.path.exists(dest):
-            try:
-                os.remove(dest)
-            except:
-                raise RemoveFileError('Could not delete the existing javascript application file.')
+        f.close()
 
+        outputs = [dest]
         try:
-            f = open(dest, 'w+')
+            replace_file(tmp_dest, dest)
+            if self._source_map is not None:
+                replace_file(tmp_dest + '.map', dest + '.map')
+                outputs.append(dest + '.map')
+            elif os.path.exists(dest + '.map'):
+                os.remove(dest + '.map')
         except:
-            raise FileNotWritableError('Could not write the javascript file.')
+            raise RemoveFileError('Could not replace the existing javascript application file.')
 
-        if self._config['minify_js']:
-            self._js_string = minify(self._js_string, mangle=True, mangle_toplevel=True)
+        self._record_stage('javascript', settings, stamp_files([source] + self._included_js_files), stamp_files(outputs))
 
-        f.write(self._js_string.encode('utf-8'))
-        f.close()
+    def _javascript_modules(self, source):
+        # Every file is minified as a whole and placed where its first code is. The //= require
+        # lines become empty lines, so the lines of a module are the lines of its file.
+        modules = []
+        index = {}
 
-    def _concat_javascript(self, source):
-        f = None
-        lines = []
+        for chunk, unit_source, line in self._javascript_units(source):
+            if unit_source is None or len(chunk.strip()) == 0:
+                continue
+
+            if unit_source not in index:
+                index[unit_source] = len(modules)
+                modules.append([[], unit_source, 0])
+
+            module = modules[index[unit_source]]
+            module[0].append(u'\n' * (line - module[2]) + chunk)
+            module[2] = line + chunk.count('\n')
+
+        return [(u''.join(parts), module_source) for parts, module_source, line in modules]
+
+    def _minify_javascript_modules(self, source, js_name):
+        modules = self._javascript_modules(source)
+        marked = self._source_map is not None
 
+        cache = self._get_minify_cache()
+        kind = ('js-module-marked:' if marked else 'js-module:') + tool_version('slimit') + ':mangle'
+        minified = [None] * len(modules)
+        keys = [None] * len(modules)
+        pending = []
+
+        for i, (text, module_source) in enumerate(modules):
+            if cache is not None:
+                keys[i] = cache.key(kind, text)
+                cached = cache.get(keys[i])
+                if cached is not None:
+                    minified[i] = cached.decode('utf-8')
+                    continue
+
+            pending.append(i)
+
+        results = minify_modules([modules[i][0] for i in pending], marked)
+
+        errors = []
+        for i, (result, error) in zip(pending, results):
+            if error is not None:
+                errors.append(modules[i][1] + ':\n' + error)
+                continue
+
+            minified[i] = result
+            if cache is not None:
+                try:
+                    cache.put(keys[i], result)
+                except (IOError, OSError):
+                    print 'Could not write to the minification cache.'
+
+        if len(errors) > 0:
+            raise JavaScriptError('Could not minify your javascript files:\n\n' + '\n\n'.join(errors))
+
+        # Minifying every module on its own can not mangle the top level names
+        # across modules, the wrapper keeps them out of the global scope instead.
+        output = [u'(function(){\n']
+        for i, (text, module_source) in enumerate(modules):
+            result = minified[i]
+            if marked:
+                module_map = SourceMap(js_name)
+                module_map.add_chunk(text, module_source)
+
+                result, minified_map = compose_marked(result, text, module_map)
+                self._source_map.append_map(minified_map, len(output))
+
+            output.append(result + u'\n')
+
+        output.append(u'}).call(this);\n')
+
+        return output
+
+    def _cached_minify(self, kind, text, minifier):
+        cache = self._get_minify_cache()
+        if cache is None:
+            return minifier()
+
+        key = cache.key(kind + ':' + tool_version('slimit') + ':mangle', text)
+        result = cache.get(key)
+        if result is not None:
+            return result.decode('utf-8')
+
+        result = minifier()
         try:
-            f = open(source)
-        except:
-            raise FileNotFoundError('The specified file does not exist: ', source)
+            cache.put(key, result)
+        except (IOError, OSError):
+            print 'Could not write to the minification cache.'
+
+        return result
+
+    def _prune_minify_cache(self):
+        if self._minify_cache is None:
+            return
 
-        self._included_js_files = []
         try:
-            lines = self._gather_javascript_lines(f)
-        except FileNotFoundError:
-            raise
-        finally:
-            f.close()
+            self._minify_cache.prune()
+        except (IOError, OSError):
+            print 'Could not clean up the minification cache.'
+
+    def _get_minify_cache(self):
+        if self._config['minify_cache'] is False:
+            return None
+
+        with self._lock:
+            if self._minify_cache is None:
+                folder = self._config['minify_cache']
+                if folder is None:
+                    folder = os.path.join(self._cwd, 'build', '.cache', 'minify')
 
-        return ''.join(lines)
+                self._minify_cache = MinifyCache(os.path.expanduser(folder), self._config['minify_cache_size'] * 1024 * 1024)
 
-    def _gather_javascript_lines(self, f):
-        lines = []
+        return self._minify_cache
 
-        for line in f:
-            line = line.decode('utf-8')
-            line = line.replace('##BUILDVERSION##', self._config['version'])
+    def _concat_javascript(self, source):
+        for chunk, unit_source, line in self._javascript_units(source):
+            if self._source_map is not None:
+                self._source_map.add_chunk(chunk, unit_source, line)
+
+            yield chunk
 
-            match = re.match('\/\/= require ([a-zA-Z\/-_]+)', line)
-            if match:
-                sub_f = None
+    def _javascript_units(self, source):
+        if self._require_graph is None:
+            self._require_graph = RequireGraph.shared(os.path.join(self._cwd, 'build', '.cache', 'requires.json'))
+
+        self._included_js_files = []
+        self._included_js_set = set()
+        try:
+            for unit in self._gather_javascript_lines(source):
+                yield unit
+        finally:
+            try:
+                self._require_graph.save()
+            except (IOError, OSError):
+                print 'Could not write the javascript require cache.'
 
-                sub_path = match.group(1)
+    def _gather_javascript_lines(self, source):
+        try:
+            chunks = self._require_graph.chunks(source)
+        except (IOError, OSError):
+            raise FileNotFoundError('The specified file does not exist: ', source)
+
+        line = 0
+        for kind, value in chunks:
+            if kind == 'require':
+                line += 1
+
+                sub_path = str(value)
                 if sys.platform.startswith('win32'):
                     sub_path = sub_path.replace('/', '\\')
                 sub_path = os.path.join(self._cwd, 'src', 'javascript', sub_path)
                 sub_path = sub_path + '.js'
 
-                if sub_path not in self._included_js_files:
+                if sub_path not in self._included_js_set:
                     self._included_js_files.append(sub_path)
+                    self._included_js_set.add(sub_path)
 
-                    try:
-                        sub_f = open(sub_path)
-                    except:
-                        raise FileNotFoundError('The specified file does not exist: ', sub_path)
-
-                    try:
-                        lines = lines + self._gather_javascript_lines(sub_f)
-                    except FileNotFoundError:
-                        raise
-                    finally:
-                        sub_f.close()
+                    for unit in self._gather_javascript_lines(sub_path):
+                        yield unit
             else:
-                lines.append(line)
+                yield (value.replace('##BUILDVERSION##', self._config['version']), os.path.relpath(source, self._cwd).replace(os.sep, '/'), line)
+                line += value.count('\n')
 
-        lines.append('\n')
-        return lines
+        yield (u'\n', None, 0)
 
     def _build_html(self):
         source = os.path.join(self._cwd, 'src', 'index.html')
         dest = os.path.join(self._config['build_path'], 'index.html')
+        asset_manifest = os.path.join(self._config['build_path'], 'asset-manifest.json')
 
         if not os.path.exists(source):
             return
 
+        settings = {'fingerprint': self._config['fingerprint']}
+        rewrite = self._config['fingerprint'] and os.path.exists(asset_manifest)
+        if rewrite:
+            inputs = stamp_files([source, asset_manifest])
+        else:
+            inputs = stamp_files([source])
+
+        if self._stage_is_current('html', settings, inputs):
+            return
+
         if os.path.exists(dest):
             try:
                 os.remove(dest)
@@ -132,10 +356,109 @@ class Build(object):
                 raise RemoveFileError('Could not remove the existing html build file.')
 
         try:
-            copy2(source, dest)
+            if rewrite:
+                text, encoding = read_text(source)
+                f = open(dest, 'wb')
+                try:
+                    f.write(rewrite_html(text, load_json(asset_manifest, {})).encode(encoding))
+                finally:
+                    f.close()
+            else:
+                copy2(source, dest)
         except:
             raise FileNotWritableError('Could not write the html file.')
 
+        self._record_stage('html', settings, inputs, stamp_files([dest]))
+
+    def _fingerprint(self):
+        build_path = self._config['build_path']
+        asset_manifest = os.path.join(build_path, 'asset-manifest.json')
+        previous = load_json(asset_manifest, {})
+
+        if not self._config['fingerprint']:
+            if os.path.exists(asset_manifest):
+                try:
+                    remove_fingerprints(build_path, previous, {})
+                    os.remove(asset_manifest)
+                except:
+                    raise RemoveFileError('Could not remove the fingerprinted files.')
+            return
+
+        js_name = self._config['js_name'] + '.js'
+        styles = []
+        references = []
+
+        style_path = os.path.join(build_path, 'style')
+        for root, dirs, files in os.walk(style_path):
+            dirs.sort()
+            for f in sorted(files):
+                if f.endswith('.css') and not is_fingerprinted(f):
+                    path = os.path.relpath(os.path.join(root, f), build_path).replace(os.sep, '/')
+                    text, encoding = read_text(os.path.join(root, f))
+                    styles.append((path, text, encoding))
+
+                    for reference in css_references(path, text):
+                        if reference not in references and os.path.isfile(os.path.join(build_path, reference)):
+                            references.append(reference)
+
+        names = [path for path in [js_name, js_name + '.map'] if os.path.exists(os.path.join(build_path, path))]
+        names += [path for path, text, encoding in styles] + references
+
+        inputs = stamp_files([os.path.join(build_path, path) for path in names])
+        if self._stage_is_current('fingerprint', {}, inputs):
+            return
+
+        mapping = {}
+        try:
+            # Referenced files keep their content, a hard link is enough.
+            for reference in references:
+                path = os.path.join(build_path, reference)
+                mapping[reference] = fingerprinted_name(reference, file_digest(path))
+                sync_file(path, os.path.join(build_path, mapping[reference]), link=True)
+
+            for path, text, encoding in styles:
+                data = rewrite_css(path, text, mapping).encode(encoding)
+                mapping[path] = fingerprinted_name(path, content_digest(data))
+                self._write_fingerprinted(os.path.join(build_path, mapping[path]), data)
+
+            if js_name in names:
+                f = open(os.path.join(build_path, js_name), 'rb')
+                try:
+                    data = f.read()
+                finally:
+                    f.close()
+
+                if js_name + '.map' in names:
+                    map_path = os.path.join(build_path, js_name + '.map')
+                    mapping[js_name + '.map'] = fingerprinted_name(js_name + '.map', file_digest(map_path))
+                    sync_file(map_path, os.path.join(build_path, mapping[js_name + '.map']), link=True)
+                    data = data.replace('sourceMappingURL=' + js_name.encode('utf-8') + '.map', 'sourceMappingURL=' + mapping[js_name + '.map'].encode('utf-8'))
+
+                mapping[js_name] = fingerprinted_name(js_name, content_digest(data))
+                self._write_fingerprinted(os.path.join(build_path, mapping[js_name]), data)
+
+            save_json(asset_manifest, mapping)
+            remove_fingerprints(build_path, previous, mapping)
+        except (IOError, OSError):
+            raise FileNotWritableError('Could not write the fingerprinted files.')
+
+        outputs = [os.path.join(build_path, path) for path in mapping.values()] + [asset_manifest]
+        self._record_stage('fingerprint', {}, inputs, stamp_files(outputs))
+
+    def _write_fingerprinted(self, path, data):
+        # The name depends on the content, an existing file is already up to date.
+        if os.path.exists(path):
+            return
+
+        tmp_path = path + '.tmp'
+        f = open(tmp_path, 'wb')
+        try:
+            f.write(data)
+        finally:
+            f.close()
+
+        replace_file(tmp_path, path)
+
     def _build_style(self):
         source = os.path.join(self._cwd, 'src', 'style')
         destination = os.path.join(self._config['build_path'], 'style')
@@ -143,102 +466,135 @@ class Build(object):
         if not os.path.exists(source):
             return
 
-        if os.path.exists(destination):
+        settings = {'minify_css': self._config['minify_css'], 'hardlink_sources': self._config['hardlink_sources']}
+        inputs = stamp_tree(source)
+        if self._stage_is_current('style', settings, inputs):
+            return
+
+        if self._manifest is None and os.path.exists(destination):
             try:
                 rmtree(destination)
             except:
                 raise RemoveFolderError('Could not remove the existing style folder.')
 
-        temp_style_dir = tempfile.mkdtemp()
+        wanted = set()
+        styles = []
 
-        try:
-            copytree(source, os.path.join(temp_style_dir, 'style'))
-        except:
-            raise CreateFolderError('Could not copy your style folder to a temporary location.')
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            target_root = os.path.normpath(os.path.join(destination, os.path.relpath(root, source)))
+            wanted.add(target_root)
 
-        self._work_css_files(os.path.join(temp_style_dir, 'style'))
+            try:
+                ensure_folder(target_root)
+            except:
+                raise CreateFolderError('Could not create the style folder:\n' + target_root)
 
-        try:
-            copytree(os.path.join(temp_style_dir, 'style'), destination)
-        except:
-            CreateFolderError('Could not copy the style folder from the temporary location.')
+            for f in sorted(files):
+                if f.endswith('.scss'):
+                    styles.append((os.path.join(root, f), os.path.join(target_root, f[:-4] + 'css')))
+                elif f.endswith('.css') and self._config['minify_css']:
+                    styles.append((os.path.join(root, f), os.path.join(target_root, f)))
+                else:
+                    try:
+                        sync_file(os.path.join(root, f), os.path.join(target_root, f), link=self._config['hardlink_sources'])
+                    except:
+                        raise FileNotWritableError('Could not copy your style file:\n' + os.path.join(root, f))
+
+                    wanted.add(os.path.join(target_root, f))
+
+        self._work_css_files(styles)
+        wanted.update(css_filename for scss_filename, css_filename in styles)
+        wanted.update(fingerprinted_files(self._config['build_path']))
 
         try:
-            rmtree(temp_style_dir)
+            remove_stale(destination, wanted)
         except:
-            RemoveFolderError('Could not remove your temporary style folder.')
+            raise RemoveFileError('Could not remove the outdated files in the style folder.')
 
-    def _work_css_files(self, folder):
-        for root, dirs, files in os.walk(folder):
-            for f in files:
-                if f.endswith('.scss'):
+        self._record_stage('style', settings, inputs, stamp_tree(destination))
 
-                    ns = scss.namespace.Namespace()
+    def _work_css_files(self, styles):
+        minify = self._config['minify_css']
+        cache = self._get_style_cache()
+        pending = []
 
-                    @ns.declare_alias('dashboard-region')
-                    def dashboard():
-                        return scss.types.Function(u'control rectangle', u'dashboard-region', quotes=None)
+        for scss_filename, css_filename in styles:
+            key = None
+            if cache is not None:
+                key = cache.key(scss_filename, minify)
 
-                    @ns.declare_alias('dashboard-region')
-                    def dashboard(val):
-                        return scss.types.Function(val.render(), u'dashboard-region', quotes=None)
+            if key is None:
+                pending.append((scss_filename, css_filename))
+            elif not cache.is_written(scss_filename, key, css_filename):
+                self._write_css_file(css_filename, cache.load(key))
+                cache.written(scss_filename, css_filename)
 
-                    compiler = scss.compiler.Compiler(namespace=ns, undefined_variables_fatal=False)
+        minify_cache = self._get_minify_cache()
+        results = compile_styles([scss_filename for scss_filename, css_filename in pending], minify, self._get_scss_compiler(), minify_cache)
 
-                    scss_filename = os.path.join(root, f)
-                    css_filename = os.path.join(root, f[:-4] + 'css')
+        if minify and minify_cache is not None and len(pending) > 0:
+            minify_cache.changed()
 
-                    try:
-                        css_string = compiler.compile(scss_filename)
-                    except scss.errors.SassEvaluationError as e:
-                        raise e
-                    except scss.errors.SyntaxError as e:
-                        raise e
-                    except scss.errors.ParseError as e:
-                        raise e
-                    except:
-                        raise FileNotFoundError('Could not find your scss style file.')
+        errors = []
+        for source, css_string, error, imports in results:
+            if error is not None:
+                errors.append(os.path.relpath(source, self._cwd) + ':\n' + error)
 
-                    try:
-                        css_file = open(css_filename, 'w+')
-                    except:
-                        raise FileNotWritableError('Could not write the new css file:\n' + css_filename)
+        if len(errors) > 0:
+            self._save_style_cache()
+            raise SassError('Could not compile your style files:\n\n' + '\n\n'.join(errors))
 
-                    if self._config['minify_css']:
-                        css_string = cssmin(css_string)
+        for (source, css_string, error, imports), (scss_filename, css_filename) in zip(results, pending):
+            if isinstance(css_string, unicode):
+                css_string = css_string.encode('utf-8')
 
-                    css_file.write(css_string)
-                    css_file.close();
+            self._write_css_file(css_filename, css_string)
 
-                    try:
-                        os.remove(scss_filename)
-                    except:
-                        raise FileNotWritableError('Could not remove already converted scss file:\n' + scss_filename)
-                elif f.endswith('.css'):
-                    if self._config['minify_css']:
-                        css_filename = os.path.join(root, f)
+            if cache is not None:
+                try:
+                    cache.store(scss_filename, imports, minify, css_string)
+                    cache.written(scss_filename, css_filename)
+                except (IOError, OSError):
+                    print 'Could not write the style cache for ' + scss_filename
 
-                        try:
-                            css_file = open(f, 'r')
-                        except:
-                            raise FileNotReadableError('Could not read your css file:\n' + css_filename)
+        self._save_style_cache()
 
-                        css_string = f.read()
-                        css_file.close()
+    def _write_css_file(self, css_filename, css_string):
+        # The old output may be a hard link to a source file, never write through it.
+        try:
+            if os.path.lexists(css_filename):
+                os.remove(css_filename)
+            css_file = open(css_filename, 'w+')
+        except:
+            raise FileNotWritableError('Could not write the new css file:\n' + css_filename)
 
-                        try:
-                            os.remove(css_file)
-                        except:
-                            raise FileNotWritableError('Could not remove your non-minified css file:\n' + css_filename)
+        css_file.write(css_string)
+        css_file.close()
 
-                        try:
-                            css_file = open(css_filename, 'w+')
-                        except:
-                            FileNotWritableError('Could not write to the new minified css file:\n' + css_filename)
+    def _get_style_cache(self):
+        if self._manifest is None:
+            return None
 
-                        css_string = cssmin(css_string)
-                        css_file.write(css_string)
-                        css_file.close()
+        if self._style_cache is None:
+            self._style_cache = StyleCache(os.path.join(self._cwd, 'build', '.cache', 'styles'))
+
+        return self._style_cache
+
+    def _save_style_cache(self):
+        if self._style_cache is None:
+            return
+
+        try:
+            self._style_cache.save()
+        except (IOError, OSError):
+            print 'Could not write the style cache.'
+
+    def _get_scss_compiler(self):
+        if self._scss_compiler is None:
+            self._scss_compiler = create_scss_compiler()
+
+        return self._scss_compiler
 
     def _build_libraries(self):
         source = os.path.join(self._cwd, 'src', 'lib')
@@ -247,35 +603,37 @@ class Build(object):
         if not os.path.exists(source):
             return
 
-        if os.path.exists(dest):
-            try:
-                rmtree(dest)
-            except:
-                raise RemoveFolderError('Could not remove the existing libraries folder.')
+        settings = {'hardlink_sources': self._config['hardlink_sources']}
+        inputs = stamp_tree(source)
+        if self._stage_is_current('libraries', settings, inputs):
+            return
 
         try:
-            copytree(source, dest)
+            sync_tree(source, dest, link=self._config['hardlink_sources'], checksum=self._config['sync_checksum'], keep=fingerprinted_files(self._config['build_path']))
         except:
             raise FileNotWritableError('Could not copy all the libraries.')
 
+        self._record_stage('libraries', settings, inputs, stamp_tree(dest))
+
     def _copy_assets(self):
         source = os.path.join(self._cwd, 'assets')
         dest = os.path.join(self._config['build_path'], 'assets')
 
         if not os.path.exists(source):
-            return;
+            return
 
-        if os.path.exists(dest):
-            try:
-                rmtree(dest)
-            except:
-                raise RemoveFolderError('Could not remove the existing assets folder.')
+        settings = {'hardlink_sources': self._config['hardlink_sources']}
+        inputs = stamp_tree(source)
+        if self._stage_is_current('assets', settings, inputs):
+            return
 
         try:
-            copytree(source, dest)
+            sync_tree(source, dest, link=self._config['hardlink_sources'], checksum=self._config['sync_checksum'], keep=fingerprinted_files(self._config['build_path']))
         except:
             raise FileNotWritableError('Could not copy all the asset files.')
 
+        self._record_stage('assets', settings, inputs, stamp_tree(dest))
+
 
 def clean():
     if not os.path.exists(os.path.join(os.getcwd(), 'build')):
@@ -2,6 +2,61 @@ import os
 from error import WrongFormatError, MissingKeyError, FileNotFoundError
 import re
 import json
+from multiprocessing import cpu_count
+
+def default_jobs():
+    try:
+        return cpu_count()
+    except NotImplementedError:
+        return 1
+
+
+def _bool(value):
+    return isinstance(value, bool)
+
+
+def _count(minimum, maximum=None):
+    def valid(value):
+        return isinstance(value, int) and not isinstance(value, bool) and value >= minimum and (maximum is None or value <= maximum)
+    return valid
+
+
+def _choice(*choices):
+    def valid(value):
+        return value in choices
+    return valid
+
+
+def _folder(value):
+    return value is False or (isinstance(value, unicode) and len(value) > 0)
+
+
+# The options that can be set globally and per project, with their check and default.
+OPTIONS = [
+    ('minify_js', _bool, False),
+    ('minify_css', _bool, False),
+    ('incremental', _bool, True),
+    ('sync_checksum', _bool, False),
+    ('hardlink_sources', _bool, False),
+    ('deploy_mode', _choice('sync', 'rename', 'symlink'), 'sync'),
+    ('fingerprint', _bool, False),
+    ('zip_compression', _choice('stored', 'deflate', 'bzip2', 'lzma'), 'deflate'),
+    ('zip_level', _count(0, 9), None),
+    ('tar_format', _choice('tar.gz', 'tar.bz2', 'tar.xz'), None),
+    ('upload_chunk_size', _count(1), None),
+    ('upload_retries', _count(0), 5),
+    ('upload_dedupe', _bool, False),
+    ('upload_cache_login', _bool, True),
+    ('target_retries', _count(0), 0),
+    ('source_map', _bool, True),
+    ('minify_js_per_module', _bool, False),
+    ('minify_cache', _folder, None),
+    ('minify_cache_size', _count(1), 256),
+    ('jobs', _count(1), default_jobs()),
+    ('show_times', _bool, False),
+    ('test_shared_files', _choice('copy', 'hardlink', 'symlink'), 'copy')
+]
+
 
 class Config(object):
     def __init__(self):
@@ -22,32 +77,32 @@ class Config(object):
         except:
             raise WrongFormatError('The provided configuration file could not be parsed.')
 
+    def _option(self, config, key, valid, default):
+        # A missing or malformed value falls back to the default (for the project that is the global value).
+        if key not in config or not valid(config[key]):
+            config[key] = default
+
     def _parse_global_config(self):
         config_path = os.path.join(os.path.expanduser('~'), '.graceconfig')
 
         try:
             config_file = open(os.path.join(config_path))
         except:
-            self._global_config = {}
+            config_file = None
             print 'No global configuration file found, using local one for all values.'
-            return
-
-        try:
-            self._global_config = self._parse_config_file(config_file)
-        except:
-            raise
 
-        if 'minify_js' not in self._global_config:
-            self._global_config['minify_js'] = False
+        if config_file is None:
+            self._global_config = {}
         else:
-            if not isinstance(self._global_config['minify_js'], bool):
-                self._global_config['minify_js'] = False
+            try:
+                self._global_config = self._parse_config_file(config_file)
+            except:
+                raise
 
-        if 'minify_css' not in self._global_config:
-            self._global_config['minify_css'] = False
-        else:
-            if not isinstance(self._global_config['minify_css'], bool):
-                self._global_config['minify_css'] = False
+        for key, valid, default in OPTIONS:
+            self._option(self._global_config, key, valid, default)
+
+        self._option(self._global_config, 'test_jobs', _count(1), self._global_config['jobs'])
 
     def _parse_local_config(self):
         cwd = os.getcwd()
@@ -77,17 +132,8 @@ class Config(object):
             if not isinstance(self._config['version'], unicode):
                 raise WrongFormatError('The version key in your config file needs to be a string!')
 
-        if 'minify_js' not in self._config:
-            self._config['minify_js'] = self._global_config['minify_js']
-        else:
-            if not isinstance(self._config['minify_js'], bool):
-                self._config['minify_js'] = False
-
-        if 'minify_css' not in self._config:
-            self._config['minify_css'] = self._global_config['minify_css']
-        else:
-            if not isinstance(self._config['minify_css'], bool):
-                self._config['minify_css'] = False
+        for key, valid, default in OPTIONS + [('test_jobs', _count(1), None)]:
+            self._option(self._config, key, valid, self._global_config[key])
 
         if 'type' not in self._config:
             self._config['type'] = 'default'
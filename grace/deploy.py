@@ -1,6 +1,13 @@
-from error import MissingKeyError, RemoveFolderError, FolderNotWritableError
+from error import MissingKeyError, FolderNotWritableError, RemoveFolderError
+from sync import exchange, sync_tree
+from fingerprint import replaced_files
+from targets import run_targets, target_list
+from shutil import rmtree
 import os
-from shutil import rmtree, copytree
+import time
+
+
+KEEP_RELEASES = 2
 
 
 class Deploy(object):
@@ -11,7 +18,7 @@ class Deploy(object):
         if 'deployment_path' not in self._config:
             raise MissingKeyError('Could not find deployment path in config file.')
         else:
-            self._deployment_path = self._config['deployment_path']
+            self._deployment_paths = target_list(self._config['deployment_path'], 'deployment_path')
 
     def run(self, testname):
         if self._config['test']:
@@ -19,24 +26,113 @@ class Deploy(object):
                 print 'No tests to build.'
                 return
 
-            dest = os.path.join(self._deployment_path, self._config['name'] + '_' + testname)
-            source = os.path.join(self._cwd, 'build', self._config['name'] + '_' + testname)
+            name = self._config['name'] + '_' + testname
         elif self._config['build']:
-            dest = os.path.join(self._deployment_path, self._config['name'])
-            source = os.path.join(self._cwd, 'build', self._config['name'])
+            name = self._config['name']
         else:
             raise MissingKeyError('It seems you are trying to deploy a project but neither build nor test were specified. I am sorry but I do not know what to do now.')
 
-        self._deploy(source, dest)
+        source = os.path.join(self._cwd, 'build', name)
+        run_targets('deploy', self._deployment_paths, lambda path: self._deploy(source, os.path.join(path, name)), self._config['jobs'], self._config['target_retries'])
 
     def _deploy(self, source, dest):
-        if os.path.exists(dest):
+        if self._config['deploy_mode'] == 'symlink':
+            self._deploy_symlink(source, dest)
+        elif self._config['deploy_mode'] == 'rename':
+            self._deploy_rename(source, dest)
+        else:
             try:
-                rmtree(dest)
+                sync_tree(source, dest, checksum=self._config['sync_checksum'], skip=replaced_files(source))
             except:
-                raise RemoveFolderError('Could not remove the existing deployment path.')
+                raise FolderNotWritableError('Could not copy the build directory to the deployment path.', transient=True)
+
+    def _stage(self, source, staging, current):
+        # Start from hard links to the live files, so only the changed files are written.
+        # sync_file replaces a changed file instead of writing into it, the live copy stays untouched.
+        try:
+            if current is not None and os.path.isdir(current):
+                sync_tree(current, staging, link=True)
+
+            sync_tree(source, staging, checksum=self._config['sync_checksum'], skip=replaced_files(source))
+        except:
+            raise FolderNotWritableError('Could not copy the build directory to the deployment path.', transient=True)
 
+    def _remove(self, path):
         try:
-            copytree(source, dest)
+            if os.path.islink(path):
+                os.remove(path)
+            elif os.path.exists(path):
+                rmtree(path)
         except:
-            raise FolderNotWritableError('Could not copy the build directory to the deployment path.')
+            raise RemoveFolderError('Could not remove the old deployment folder: ' + path, transient=True)
+
+    def _deploy_rename(self, source, dest):
+        parent, name = os.path.split(os.path.normpath(dest))
+        staging = os.path.join(parent, '.' + name + '.new')
+        previous = os.path.join(parent, '.' + name + '.old')
+
+        self._remove(staging)
+        self._remove(previous)
+        self._stage(source, staging, dest)
+
+        try:
+            if os.path.isdir(dest) and not os.path.islink(dest) and exchange(staging, dest):
+                # The old deployment is now in the staging folder, the path never went missing.
+                previous = staging
+            else:
+                if os.path.lexists(dest):
+                    os.rename(dest, previous)
+                os.rename(staging, dest)
+        except:
+            raise FolderNotWritableError('Could not move the new deployment into place.', transient=True)
+
+        self._remove(previous)
+
+    def _deploy_symlink(self, source, dest):
+        if not hasattr(os, 'symlink'):
+            self._deploy_rename(source, dest)
+            return
+
+        parent, name = os.path.split(os.path.normpath(dest))
+        releases_name = '.' + name + '.releases'
+        releases = os.path.join(parent, releases_name)
+
+        release_name = time.strftime('%Y%m%d%H%M%S')
+        suffix = 1
+        while os.path.lexists(os.path.join(releases, release_name)):
+            release_name = time.strftime('%Y%m%d%H%M%S') + '_' + str(suffix)
+            suffix += 1
+
+        self._stage(source, os.path.join(releases, release_name), os.path.realpath(dest) if os.path.lexists(dest) else None)
+
+        # Renaming a new link over the old one switches the deployment in one step.
+        link = os.path.join(parent, '.' + name + '.link')
+        try:
+            if os.path.lexists(link):
+                os.remove(link)
+            os.symlink(os.path.join(releases_name, release_name), link)
+        except:
+            raise FolderNotWritableError('Could not create the link to the new deployment.', transient=True)
+
+        if os.path.isdir(dest) and not os.path.islink(dest):
+            # A folder can not be replaced by a link in one step, this only happens on the first switch.
+            previous = os.path.join(parent, '.' + name + '.old')
+            self._remove(previous)
+            try:
+                os.rename(dest, previous)
+            except:
+                raise FolderNotWritableError('Could not move the old deployment folder away.', transient=True)
+        else:
+            previous = None
+
+        try:
+            os.rename(link, dest)
+        except:
+            raise FolderNotWritableError('Could not switch the deployment to the new folder.', transient=True)
+
+        if previous is not None:
+            self._remove(previous)
+
+        for old in sorted(os.listdir(releases))[:-KEEP_RELEASES]:
+            if old != release_name:
+                self._remove(os.path.join(releases, old))
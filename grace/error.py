@@ -1,10 +1,13 @@
 class Error(Exception):
-    def __init__(self, msg='', arg=None):
+    def __init__(self, msg='', arg=None, transient=False):
         if arg:
             self.msg = msg + arg
         else:
             self.msg = msg
 
+        # A failure of the network or the target that may not happen again when tried later.
+        self.transient = transient
+
     def __repr__(self):
         return self.msg
 
@@ -61,6 +64,10 @@ class SassError(Error):
     pass
 
 
+class JavaScriptError(Error):
+    pass
+
+
 class WrongLoginCredentials(Error):
     pass
 
@@ -71,3 +78,15 @@ class GeneralError(Error):
 
 class FileUploadError(Error):
     pass
+
+
+class StageError(Error):
+    pass
+
+
+class TestError(Error):
+    pass
+
+
+class TargetError(Error):
+    pass
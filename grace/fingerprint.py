@@ -0,0 +1,126 @@
+from utils import load_json
+import hashlib
+import os
+import posixpath
+import re
+
+
+HASH_LENGTH = 10
+URL_PATTERN = re.compile(u'url\\(\\s*([\'"]?)([^\'")]+?)\\1\\s*\\)')
+ATTRIBUTE_PATTERN = re.compile(u'((?:src|href)\\s*=\\s*)([\'"])([^\'"]+)\\2', re.IGNORECASE)
+FINGERPRINTED_PATTERN = re.compile(u'\\.[0-9a-f]{%d}\\.[^./]+$' % HASH_LENGTH)
+
+
+def fingerprinted_name(path, digest):
+    root, ext = posixpath.splitext(path)
+    return root + u'.' + digest[:HASH_LENGTH] + ext
+
+
+def is_fingerprinted(path):
+    return FINGERPRINTED_PATTERN.search(path) is not None
+
+
+def content_digest(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+def read_text(path):
+    f = open(path, 'rb')
+    try:
+        data = f.read()
+    finally:
+        f.close()
+
+    try:
+        return (data.decode('utf-8'), 'utf-8')
+    except UnicodeDecodeError:
+        return (data.decode('latin-1'), 'latin-1')
+
+
+def _is_local(url):
+    return not (url.startswith(u'data:') or url.startswith(u'/') or url.startswith(u'#') or u'://' in url)
+
+
+def _split_url(url):
+    for i, character in enumerate(url):
+        if character == u'?' or character == u'#':
+            return (url[:i], url[i:])
+
+    return (url, u'')
+
+
+def _target(folder, url):
+    if not _is_local(url):
+        return None
+
+    path, suffix = _split_url(url)
+    if len(path) == 0:
+        return None
+
+    return posixpath.normpath(posixpath.join(folder, path))
+
+
+def _hashed_url(url, hashed):
+    # The fingerprinted file sits next to the original, only the file name changes.
+    path, suffix = _split_url(url)
+    return posixpath.join(posixpath.dirname(path), posixpath.basename(hashed)) + suffix
+
+
+def css_references(css_path, text):
+    folder = posixpath.dirname(css_path)
+    references = []
+
+    for match in URL_PATTERN.finditer(text):
+        target = _target(folder, match.group(2).strip())
+        if target is not None and target not in references:
+            references.append(target)
+
+    return references
+
+
+def rewrite_css(css_path, text, mapping):
+    folder = posixpath.dirname(css_path)
+
+    def replace(match):
+        url = match.group(2).strip()
+        target = _target(folder, url)
+        if target not in mapping:
+            return match.group(0)
+
+        return u'url(' + match.group(1) + _hashed_url(url, mapping[target]) + match.group(1) + u')'
+
+    return URL_PATTERN.sub(replace, text)
+
+
+def rewrite_html(text, mapping):
+    def replace(match):
+        url = match.group(3).strip()
+        target = _target(u'', url)
+        if target not in mapping:
+            return match.group(0)
+
+        return match.group(1) + match.group(2) + _hashed_url(url, mapping[target]) + match.group(2)
+
+    return ATTRIBUTE_PATTERN.sub(replace, text)
+
+
+def remove_fingerprints(build_path, previous, mapping):
+    keep = set(mapping.values())
+
+    for hashed in previous.values():
+        path = os.path.join(build_path, *hashed.split(u'/'))
+        if hashed not in keep and os.path.lexists(path):
+            os.remove(path)
+
+
+def fingerprinted_files(build_path):
+    # The copies that the build stages have to keep when they remove their outdated files.
+    mapping = load_json(os.path.join(build_path, 'asset-manifest.json'), {})
+    return set(os.path.join(build_path, *hashed.split(u'/')) for hashed in mapping.values())
+
+
+def replaced_files(build_path):
+    # index.html and the CSS files only point to the copies of these, deployments and archives
+    # leave the originals out. Other referenced files may still be loaded by their name.
+    mapping = load_json(os.path.join(build_path, 'asset-manifest.json'), {})
+    return set(os.path.join(build_path, *name.split(u'/')) for name in mapping if name.endswith((u'.js', u'.js.map', u'.css')))
@@ -1,7 +1,7 @@
 from grace.task import Task
 from grace.create import New, Assets
 from grace.config import Config
-from grace.error import FileNotFoundError, WrongFormatError, MissingKeyError, CreateFolderError, FolderNotFoundError, FileNotWritableError, RemoveFolderError, RemoveFileError, FolderAlreadyExistsError, SassError, UnknownCommandError, WrongLoginCredentials, FileUploadError
+from grace.error import FileNotFoundError, WrongFormatError, MissingKeyError, CreateFolderError, FolderNotFoundError, FileNotWritableError, RemoveFolderError, RemoveFileError, FolderAlreadyExistsError, SassError, JavaScriptError, StageError, TestError, TargetError, UnknownCommandError, WrongLoginCredentials, FileUploadError
 import sys
 import os
 from shutil import copy
@@ -226,7 +226,7 @@ def execute(args, show_stacktrace=False):
 
         try:
             task.execute()
-        except (FileNotFoundError, WrongFormatError, MissingKeyError, CreateFolderError, FolderNotFoundError, FileNotWritableError, RemoveFolderError, RemoveFileError, FolderAlreadyExistsError, SassError, WrongLoginCredentials, FileUploadError) as e:
+        except (FileNotFoundError, WrongFormatError, MissingKeyError, CreateFolderError, FolderNotFoundError, FileNotWritableError, RemoveFolderError, RemoveFileError, FolderAlreadyExistsError, SassError, JavaScriptError, StageError, TestError, TargetError, WrongLoginCredentials, FileUploadError) as e:
             print_error_msg(e.msg)
         except Exception as e:
             print_error_msg('Could not execute the given task. Something went wrong, please try again!')
@@ -242,10 +242,12 @@ def print_help():
     print 'fast and clean manner.'
     print '\nUsage'
     print '-----'
-    print 'python manage.py [command]'
+    print 'python manage.py [command] [command ...]'
     print '\nCommands'
     print '--------\n'
     print 'build\t\tBuilds the project and places the output in ./build/ProjectName.'
+    print 'watch\t\tBuild the project and rebuild the changed parts whenever a'
+    print '\t\tsource file changes.'
     print 'deploy\t\tFirst build and then deploy the project to the path'
     print '\t\tspecified in the deployment_path option in your project.cfg file.'
     print 'jsdoc\t\tBuild the jsDoc of the project.'
@@ -255,9 +257,12 @@ def print_help():
     print 'test\t\tBuild all the tests.'
     print 'test:deploy\tBuild and then deploy the tests.'
     print 'test:zip\tBuild and then zip the tests'
+    print 'test:upload\tBuild, zip and then upload the tests.'
     print 'upload\tUpload the project to the specified server.'
     print 'st\t\tCan be used with any command to show the full stack trace'
     print '\t\t(in case of an error).'
+    print '\nSeveral commands can be given at once, the ones that do not depend on'
+    print 'each other run at the same time.'
     print '\nThe global configuration file can be found at: ' + userhome
     print '\nFurther Reading'
     print '---------------'
@@ -0,0 +1,96 @@
+from utils import load_json, save_json, path_key
+import os
+
+
+MANIFEST_VERSION = 1
+
+
+def stamp(path):
+    stat = os.stat(path)
+    return [stat.st_mtime, stat.st_size]
+
+
+def stamp_files(paths):
+    stamps = {}
+    for path in paths:
+        stamps[path_key(path)] = stamp(path)
+
+    return stamps
+
+
+def stamp_tree(folder):
+    stamps = {}
+    if not os.path.exists(folder):
+        return stamps
+
+    for root, dirs, files in os.walk(folder):
+        for f in files:
+            path = os.path.join(root, f)
+            stamps[path_key(path)] = stamp(path)
+
+    return stamps
+
+
+class BuildManifest(object):
+    def __init__(self, path):
+        self._path = path
+        self._dirty = False
+
+        data = load_json(path, {})
+        if data.get('version') != MANIFEST_VERSION:
+            data = {}
+
+        self._stages = data.get('stages', {})
+
+    def is_current(self, stage, settings, inputs=None):
+        record = self._stages.get(stage)
+        if record is None:
+            return False
+
+        if record['settings'] != settings:
+            return False
+
+        try:
+            if inputs is None:
+                inputs = stamp_files(record['inputs'].keys())
+            if inputs != record['inputs']:
+                return False
+
+            if stamp_files(record['outputs'].keys()) != record['outputs']:
+                return False
+        except OSError:
+            return False
+
+        return True
+
+    def inputs(self, stage):
+        record = self._stages.get(stage)
+        if record is None:
+            return {}
+        return record['inputs']
+
+    def outputs(self, stage):
+        record = self._stages.get(stage)
+        if record is None:
+            return {}
+        return record['outputs']
+
+    def update(self, stage, settings, inputs, outputs):
+        self._stages[stage] = {
+            'settings': settings,
+            'inputs': inputs,
+            'outputs': outputs
+        }
+        self._dirty = True
+
+    def invalidate(self, stage):
+        if stage in self._stages:
+            del self._stages[stage]
+            self._dirty = True
+
+    def save(self):
+        if not self._dirty:
+            return
+
+        save_json(self._path, {'version': MANIFEST_VERSION, 'stages': self._stages})
+        self._dirty = False
@@ -0,0 +1,121 @@
+from utils import replace_file
+import hashlib
+import os
+import pkg_resources
+import re
+import thread
+
+
+# Only these files are grace's entries, everything else in a shared cache folder is left alone.
+PREFIX_PATTERN = re.compile('^[0-9a-f]{2}$')
+ENTRY_PATTERN = re.compile('^[0-9a-f]{40}$')
+
+
+def tool_version(name):
+    try:
+        return pkg_resources.get_distribution(name).version
+    except Exception:
+        return ''
+
+
+class MinifyCache(object):
+    def __init__(self, folder, max_size=256 * 1024 * 1024):
+        self._folder = folder
+        self._max_size = max_size
+        self._changed = False
+
+    def settings(self):
+        return (self._folder, self._max_size)
+
+    def _path(self, key):
+        return os.path.join(self._folder, key[:2], key)
+
+    def key(self, kind, text):
+        h = hashlib.sha1(kind)
+        h.update('\0')
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+        h.update(text)
+
+        return h.hexdigest()
+
+    def get(self, key):
+        path = self._path(key)
+
+        try:
+            f = open(path, 'rb')
+        except IOError:
+            return None
+
+        try:
+            data = f.read()
+        finally:
+            f.close()
+
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+        return data
+
+    def put(self, key, result):
+        path = self._path(key)
+        folder = os.path.dirname(path)
+
+        try:
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+        except OSError:
+            if not os.path.isdir(folder):
+                raise
+
+        tmp_path = path + '.%d.%d.tmp' % (os.getpid(), thread.get_ident())
+        f = open(tmp_path, 'wb')
+        try:
+            f.write(result.encode('utf-8') if isinstance(result, unicode) else result)
+        finally:
+            f.close()
+
+        replace_file(tmp_path, path)
+        self._changed = True
+
+    def changed(self):
+        # Entries written by other processes, e.g. the style workers.
+        self._changed = True
+
+    def prune(self):
+        if not self._changed or not os.path.isdir(self._folder):
+            return
+
+        self._changed = False
+        entries = []
+        total = 0
+        for prefix in os.listdir(self._folder):
+            folder = os.path.join(self._folder, prefix)
+            if not PREFIX_PATTERN.match(prefix) or not os.path.isdir(folder):
+                continue
+
+            for f in os.listdir(folder):
+                if not ENTRY_PATTERN.match(f) or not f.startswith(prefix):
+                    continue
+
+                path = os.path.join(folder, f)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= self._max_size:
+                break
+
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
@@ -0,0 +1,119 @@
+from utils import load_json, save_json, path_key
+from cStringIO import StringIO
+import hashlib
+import os
+import re
+import sys
+import threading
+
+
+CACHE_VERSION = 1
+REQUIRE_PATTERN = re.compile('\/\/= require ([a-zA-Z\/-_]+)')
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+class RequireGraph(object):
+    @classmethod
+    def shared(cls, cache_path):
+        # One graph per cache file, so the builds running in parallel threads parse every file only once.
+        with _shared_lock:
+            if cache_path not in _shared:
+                _shared[cache_path] = cls(cache_path)
+
+            return _shared[cache_path]
+
+    def __init__(self, cache_path):
+        self._cache_path = cache_path
+        self._dirty = False
+        self._lock = threading.RLock()
+
+        data = load_json(cache_path, {})
+        if data.get('version') != CACHE_VERSION:
+            data = {}
+
+        self._files = data.get('files', {})
+
+    def get(self, path):
+        with self._lock:
+            stat = os.stat(path)
+            key = path_key(path)
+            entry = self._files.get(key)
+
+            if entry is not None and entry['mtime'] == stat.st_mtime and entry['size'] == stat.st_size:
+                return entry
+
+            f = open(path, 'rb')
+            try:
+                data = f.read()
+            finally:
+                f.close()
+
+            digest = hashlib.sha1(data).hexdigest()
+            if entry is None or entry['hash'] != digest:
+                entry = self._parse(data)
+                entry['hash'] = digest
+
+            entry['mtime'] = stat.st_mtime
+            entry['size'] = stat.st_size
+
+            self._files[key] = entry
+            self._dirty = True
+
+            return entry
+
+    def chunks(self, path):
+        return self.get(path)['chunks']
+
+    def requires(self, path):
+        return self.get(path)['requires']
+
+    def forget(self, path):
+        with self._lock:
+            key = path_key(path)
+            if key in self._files:
+                del self._files[key]
+                self._dirty = True
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+
+            for path in self._files.keys():
+                if not os.path.exists(path):
+                    del self._files[path]
+
+            save_json(self._cache_path, {'version': CACHE_VERSION, 'files': self._files})
+            self._dirty = False
+
+    def _parse(self, data):
+        if sys.platform.startswith('win32'):
+            data = data.replace('\r\n', '\n')
+
+        chunks = []
+        requires = []
+        text = []
+
+        for line in StringIO(data):
+            line = line.decode('utf-8')
+
+            match = REQUIRE_PATTERN.match(line)
+            if match:
+                if len(text) > 0:
+                    chunks.append(['text', ''.join(text)])
+                    text = []
+
+                chunks.append(['require', match.group(1)])
+                requires.append(match.group(1))
+            else:
+                text.append(line)
+
+        if len(text) > 0:
+            chunks.append(['text', ''.join(text)])
+
+        return {
+            'chunks': chunks,
+            'requires': requires
+        }
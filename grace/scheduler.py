@@ -0,0 +1,117 @@
+from error import StageError
+import Queue
+import sys
+import threading
+import time
+
+
+class StageScheduler(object):
+    def __init__(self, stages, jobs=1):
+        self._jobs = jobs
+        self._order = []
+        self._functions = {}
+        self._dependencies = {}
+
+        # Plugins may still declare their stages as (name, function) pairs.
+        for stage in stages:
+            name = stage[0]
+            if name in self._functions:
+                raise StageError('The build stage is declared twice: ', name)
+
+            self._order.append(name)
+            self._functions[name] = stage[1]
+            self._dependencies[name] = list(stage[2]) if len(stage) > 2 else []
+
+        for name in self._order:
+            for dependency in self._dependencies[name]:
+                if dependency not in self._functions:
+                    raise StageError('The build stage ' + name + ' depends on the unknown stage: ', dependency)
+
+        self._check_cycles()
+
+    def _check_cycles(self):
+        done = set()
+
+        while len(done) < len(self._order):
+            ready = [name for name in self._order if name not in done and all(d in done for d in self._dependencies[name])]
+            if len(ready) == 0:
+                raise StageError('The build stages depend on each other: ', ', '.join(name for name in self._order if name not in done))
+
+            done.update(ready)
+
+    def _dependents(self, names):
+        names = set(names)
+
+        while True:
+            more = set(name for name in self._order if name not in names and any(d in names for d in self._dependencies[name]))
+            if len(more) == 0:
+                return names
+            names |= more
+
+    def run(self, selected=None):
+        # A stage that runs again invalidates everything that uses its output.
+        if selected is None:
+            pending = list(self._order)
+        else:
+            selected = self._dependents(selected)
+            pending = [name for name in self._order if name in selected]
+
+        times = {}
+        if self._jobs <= 1 or len(pending) <= 1:
+            for name in pending:
+                start = time.time()
+                self._functions[name]()
+                times[name] = time.time() - start
+
+            return times
+
+        done = set(name for name in self._order if name not in pending)
+        running = set()
+        results = Queue.Queue()
+        error = None
+
+        while len(running) > 0 or (error is None and len(pending) > 0):
+            if error is None:
+                for name in list(pending):
+                    if len(running) >= self._jobs:
+                        break
+
+                    if all(d in done for d in self._dependencies[name]):
+                        pending.remove(name)
+                        running.add(name)
+
+                        thread = threading.Thread(target=self._run_stage, args=(name, results))
+                        thread.daemon = True
+                        thread.start()
+
+                if len(running) == 0:
+                    break
+
+            # Without a timeout the wait can not be interrupted with Ctrl+C.
+            name, seconds, exc_info = results.get(True, 365 * 24 * 3600)
+            running.remove(name)
+
+            if exc_info is not None:
+                if error is None:
+                    error = exc_info
+            else:
+                done.add(name)
+                times[name] = seconds
+
+        if error is not None:
+            raise error[0], error[1], error[2]
+
+        return times
+
+    def _run_stage(self, name, results):
+        start = time.time()
+        try:
+            self._functions[name]()
+        except:
+            results.put((name, time.time() - start, sys.exc_info()))
+            return
+
+        results.put((name, time.time() - start, None))
+
+    def format_times(self, times):
+        return ', '.join('%s %.2fs' % (name, times[name]) for name in self._order if name in times)
@@ -0,0 +1,255 @@
+from slimit.parser import Parser
+from slimit.lexer import Lexer
+from slimit import minify
+from slimit.visitors import minvisitor
+from slimit import mangler
+from bisect import bisect_right
+from workers import run_work
+import json
+import re
+
+
+BASE64_DIGITS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/'
+MARKER_PATTERN = re.compile(u'\x00(\\d+)\x01')
+
+
+def _vlq(value):
+    if value < 0:
+        value = ((-value) << 1) | 1
+    else:
+        value = value << 1
+
+    encoded = ''
+    while True:
+        digit = value & 31
+        value >>= 5
+        if value > 0:
+            digit |= 32
+        encoded += BASE64_DIGITS[digit]
+        if value == 0:
+            return encoded
+
+
+class SourceMap(object):
+    def __init__(self, filename, source_root=None):
+        self._filename = filename
+        self._source_root = source_root
+        self._sources = []
+        self._source_index = {}
+        self._lines = [[]]
+        self._column = 0
+
+    def _index(self, source):
+        if source not in self._source_index:
+            self._source_index[source] = len(self._sources)
+            self._sources.append(source)
+
+        return self._source_index[source]
+
+    def add_chunk(self, text, source=None, line=0):
+        index = None
+        if source is not None:
+            index = self._index(source)
+
+        parts = text.split('\n')
+        for i, part in enumerate(parts):
+            if i > 0:
+                self._lines.append([])
+                self._column = 0
+
+            if index is not None and (len(part) > 0 or i < len(parts) - 1):
+                self._lines[-1].append((self._column, index, line + i, 0))
+
+            self._column += len(part)
+
+    def add_mapping(self, line, column, source, source_line, source_column=0):
+        while len(self._lines) <= line:
+            self._lines.append([])
+
+        self._lines[line].append((column, self._index(source), source_line, source_column))
+
+    def append_map(self, other, line):
+        for offset, segments in enumerate(other._lines):
+            for column, index, source_line, source_column in segments:
+                self.add_mapping(line + offset, column, other._sources[index], source_line, source_column)
+
+    def lookup(self, line, column=0):
+        if line >= len(self._lines):
+            return None
+
+        found = None
+        for segment in self._lines[line]:
+            if segment[0] > column:
+                break
+            found = segment
+
+        if found is None:
+            return None
+
+        return (self._sources[found[1]], found[2], found[3] + column - found[0])
+
+    def mappings(self):
+        encoded_lines = []
+        previous = [0, 0, 0]
+
+        for segments in self._lines:
+            encoded = []
+            previous_column = 0
+
+            for column, index, line, source_column in sorted(segments):
+                encoded.append(
+                    _vlq(column - previous_column) +
+                    _vlq(index - previous[0]) +
+                    _vlq(line - previous[1]) +
+                    _vlq(source_column - previous[2])
+                )
+                previous_column = column
+                previous = [index, line, source_column]
+
+            encoded_lines.append(','.join(encoded))
+
+        return ';'.join(encoded_lines)
+
+    def to_json(self):
+        data = {
+            'version': 3,
+            'file': self._filename,
+            'sources': self._sources,
+            'names': [],
+            'mappings': self.mappings()
+        }
+        if self._source_root is not None:
+            data['sourceRoot'] = self._source_root
+
+        return json.dumps(data)
+
+    def save(self, path):
+        f = open(path, 'w+')
+        try:
+            f.write(self.to_json())
+        finally:
+            f.close()
+
+
+class _TrackingLexer(Lexer):
+    # ply's tracking reads the position of empty productions from the lexer, slimit's wrapper does not keep it.
+    def input(self, text):
+        Lexer.input(self, text)
+        self.lineno = self.lexer.lineno
+        self.lexpos = self.lexer.lexpos
+
+    def token(self):
+        token = Lexer.token(self)
+        self.lineno = self.lexer.lineno
+        self.lexpos = self.lexer.lexpos
+        return token
+
+
+class _TrackingParser(Parser):
+    def __init__(self):
+        Parser.__init__(self)
+        self.lexer = _TrackingLexer()
+        self.lexer.build(optimize=self.lex_optimize, lextab=self.lextab)
+
+    def parse(self, text, debug=False):
+        return self.parser.parse(text, lexer=self.lexer, debug=debug, tracking=True)
+
+    def _track(self, p):
+        if p[0] is not None and getattr(p[0], '_grace_lexpos', None) is None:
+            p[0]._grace_lexpos = p.lexpos(1)
+
+    # ply reads the grammar from the docstrings, keep them identical to slimit's.
+    def p_source_element(self, p):
+        p[0] = p[1]
+        self._track(p)
+    p_source_element.__doc__ = Parser.p_source_element.__func__.__doc__
+
+    def p_statement(self, p):
+        p[0] = p[1]
+        self._track(p)
+    p_statement.__doc__ = Parser.p_statement.__func__.__doc__
+
+
+class _MarkingMinifier(minvisitor.ECMAMinifier):
+    def visit(self, node):
+        output = minvisitor.ECMAMinifier.visit(self, node)
+
+        lexpos = getattr(node, '_grace_lexpos', None)
+        if lexpos is None:
+            return output
+
+        return u'\x00%d\x01' % lexpos + output
+
+
+def minify_marked(text, mangle=False, mangle_toplevel=False):
+    # Like slimit's minify, every text gets a parser of its own.
+    tree = _TrackingParser().parse(text)
+    if mangle:
+        mangler.mangle(tree, toplevel=mangle_toplevel)
+
+    return _MarkingMinifier().visit(tree)
+
+
+def minify_with_map(text, source_map, mangle=False, mangle_toplevel=False):
+    return compose_marked(minify_marked(text, mangle, mangle_toplevel), text, source_map)
+
+
+def _minify_bundle(job):
+    text, marked = job
+    if marked:
+        return minify_marked(text, mangle=True, mangle_toplevel=True)
+
+    return minify(text, mangle=True, mangle_toplevel=True)
+
+
+def minify_bundle(text, marked=False):
+    # The build stages run in threads, a worker process keeps the minification
+    # from holding the interpreter lock while the other stages copy files.
+    return run_work(_minify_bundle, [(text, marked)])[0]
+
+
+def compose_marked(marked, text, source_map):
+    line_starts = [0] + [match.end() for match in re.finditer('\n', text)]
+    minified_map = SourceMap(source_map._filename, source_map._source_root)
+    output = []
+    line = 0
+    column = 0
+    position = 0
+
+    for match in MARKER_PATTERN.finditer(marked):
+        piece = marked[position:match.start()]
+        output.append(piece)
+
+        newlines = piece.count('\n')
+        if newlines > 0:
+            line += newlines
+            column = len(piece) - piece.rfind('\n') - 1
+        else:
+            column += len(piece)
+
+        lexpos = int(match.group(1))
+        bundle_line = bisect_right(line_starts, lexpos) - 1
+        mapped = source_map.lookup(bundle_line, lexpos - line_starts[bundle_line])
+        if mapped is not None:
+            minified_map.add_mapping(line, column, mapped[0], mapped[1], mapped[2])
+
+        position = match.end()
+
+    output.append(marked[position:])
+
+    return (u''.join(output), minified_map)
+
+
+def _minify_module(job):
+    text, marked = job
+    try:
+        if marked:
+            return (minify_marked(text, mangle=True), None)
+
+        return (minify(text, mangle=True), None)
+    except Exception as e:
+        return (None, unicode(e))
+
+
+def minify_modules(texts, marked=False):
+    return run_work(_minify_module, [(text, marked) for text in texts])
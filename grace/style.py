@@ -0,0 +1,250 @@
+from cssmin import cssmin
+from utils import load_json, save_json, path_key, file_digest
+from minifycache import MinifyCache, tool_version
+from workers import has_workers, run_work
+import hashlib
+import os
+import scss
+import scss.source
+
+
+STYLE_CACHE_VERSION = 1
+
+_compiler = None
+
+
+def create_scss_compiler():
+    ns = scss.namespace.Namespace()
+
+    @ns.declare_alias('dashboard-region')
+    def dashboard():
+        return scss.types.Function(u'control rectangle', u'dashboard-region', quotes=None)
+
+    @ns.declare_alias('dashboard-region')
+    def dashboard(val):
+        return scss.types.Function(val.render(), u'dashboard-region', quotes=None)
+
+    return scss.compiler.Compiler(namespace=ns, undefined_variables_fatal=False)
+
+
+def _worker_compiler():
+    global _compiler
+    if _compiler is None:
+        _compiler = create_scss_compiler()
+
+    return _compiler
+
+
+def compile_style(job, compiler=None):
+    # Runs inside the worker processes, so only plain values go in and out.
+    source, minify, cache_settings = job
+
+    if compiler is None:
+        compiler = _worker_compiler()
+
+    imports = []
+
+    try:
+        if source.endswith('.scss'):
+            css_string, imports = _compile_scss(compiler, source)
+        else:
+            f = open(source, 'r')
+            try:
+                css_string = f.read()
+            finally:
+                f.close()
+    except (IOError, OSError):
+        return (source, None, 'Could not read your style file.', imports)
+    except Exception as e:
+        return (source, None, unicode(e), imports)
+
+    if minify:
+        css_string = _cached_cssmin(css_string, cache_settings)
+
+    return (source, css_string, None, imports)
+
+
+def _cached_cssmin(css_string, cache_settings):
+    if cache_settings is None:
+        return cssmin(css_string)
+
+    cache = MinifyCache(*cache_settings)
+    key = cache.key('css:' + tool_version('cssmin'), css_string)
+
+    result = cache.get(key)
+    if result is not None:
+        if isinstance(css_string, unicode):
+            return result.decode('utf-8')
+        return result
+
+    result = cssmin(css_string)
+    try:
+        cache.put(key, result)
+    except (IOError, OSError):
+        pass
+
+    return result
+
+
+def _compile_scss(compiler, source):
+    compilation = compiler.make_compilation()
+    compilation.add_source(scss.source.SourceFile.from_filename(compiler.normalize_path(source)))
+    css_string = compiler.call_and_catch_errors(compilation.run)
+
+    imports = []
+    for imported in compilation.sources:
+        path = getattr(imported, 'path', None)
+        if path is None:
+            return (css_string, None)
+
+        path = os.path.abspath(unicode(path))
+        if path != path_key(os.path.abspath(source)) and path not in imports:
+            imports.append(path)
+
+    return (css_string, sorted(imports))
+
+
+def compile_styles(sources, minify, compiler=None, minify_cache=None):
+    cache_settings = None
+    if minify_cache is not None:
+        cache_settings = minify_cache.settings()
+
+    work = [(source, minify, cache_settings) for source in sources]
+
+    # Without the worker processes (or for a single file) the compiler of the build is used.
+    if len(work) <= 1 or not has_workers():
+        if compiler is None:
+            compiler = create_scss_compiler()
+        return [compile_style(job, compiler) for job in work]
+
+    return run_work(compile_style, work)
+
+
+class StyleCache(object):
+    def __init__(self, folder):
+        self._folder = folder
+        self._index_path = os.path.join(folder, 'index.json')
+        self._dirty = False
+
+        data = load_json(self._index_path, {})
+        if data.get('version') != STYLE_CACHE_VERSION:
+            data = {}
+
+        self._files = data.get('files', {})
+        self._entries = data.get('entries', {})
+
+    def _digest(self, path):
+        key = path_key(path)
+        stat = os.stat(path)
+        record = self._files.get(key)
+
+        if record is not None and record[0] == stat.st_mtime and record[1] == stat.st_size:
+            return record[2]
+
+        digest = file_digest(path)
+        self._files[key] = [stat.st_mtime, stat.st_size, digest]
+        self._dirty = True
+
+        return digest
+
+    def _closure_key(self, source, imports, minify):
+        h = hashlib.sha1()
+        h.update(getattr(scss, '__version__', '') + ':' + str(minify))
+
+        for path in [source] + imports:
+            h.update(path_key(path).encode('utf-8'))
+            h.update(self._digest(path))
+
+        return h.hexdigest()
+
+    def key(self, source, minify):
+        entry = self._entries.get(path_key(source))
+        if entry is None or entry['imports'] is None:
+            return None
+
+        try:
+            key = self._closure_key(source, entry['imports'], minify)
+        except OSError:
+            return None
+
+        if not os.path.exists(os.path.join(self._folder, key + '.css')):
+            return None
+
+        return key
+
+    def is_written(self, source, key, dest):
+        entry = self._entries.get(path_key(source))
+        if entry is None or entry['key'] != key or entry['output'] is None:
+            return False
+
+        try:
+            stat = os.stat(dest)
+        except OSError:
+            return False
+
+        return entry['output'] == [path_key(dest), stat.st_mtime, stat.st_size]
+
+    def load(self, key):
+        try:
+            f = open(os.path.join(self._folder, key + '.css'), 'rb')
+        except IOError:
+            return None
+
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    def store(self, source, imports, minify, css_string):
+        key = None
+        if imports is not None:
+            key = self._closure_key(source, imports, minify)
+
+            if not os.path.exists(self._folder):
+                os.makedirs(self._folder)
+
+            f = open(os.path.join(self._folder, key + '.css'), 'wb')
+            try:
+                f.write(css_string)
+            finally:
+                f.close()
+
+        self._entries[path_key(source)] = {
+            'imports': imports,
+            'key': key,
+            'output': None
+        }
+        self._dirty = True
+
+    def written(self, source, dest):
+        entry = self._entries.get(path_key(source))
+        if entry is None:
+            return
+
+        stat = os.stat(dest)
+        entry['output'] = [path_key(dest), stat.st_mtime, stat.st_size]
+        self._dirty = True
+
+    def save(self):
+        if not self._dirty:
+            return
+
+        for source in self._entries.keys():
+            if not os.path.exists(source):
+                del self._entries[source]
+
+        for path in self._files.keys():
+            if not os.path.exists(path):
+                del self._files[path]
+
+        keys = set(entry['key'] + '.css' for entry in self._entries.values() if entry['key'] is not None)
+        for f in os.listdir(self._folder) if os.path.exists(self._folder) else []:
+            if f.endswith('.css') and f not in keys:
+                os.remove(os.path.join(self._folder, f))
+
+        save_json(self._index_path, {
+            'version': STYLE_CACHE_VERSION,
+            'files': self._files,
+            'entries': self._entries
+        })
+        self._dirty = False
@@ -0,0 +1,216 @@
+from utils import file_digest
+from shutil import copystat
+import ctypes
+import ctypes.util
+import os
+import sys
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+FICLONE = 0x40049409
+COPY_CHUNK_SIZE = 1024 * 1024
+KERNEL_CHUNK_SIZE = 1 << 30
+AT_FDCWD = -100
+RENAME_EXCHANGE = 2
+
+_libc_functions = None
+
+
+def _get_libc_functions():
+    global _libc_functions
+    if _libc_functions is not None:
+        return _libc_functions
+
+    _libc_functions = {}
+    if not sys.platform.startswith('linux'):
+        return _libc_functions
+
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    except OSError:
+        return _libc_functions
+
+    signatures = [
+        ('copy_file_range', [ctypes.c_int, ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p, ctypes.c_size_t, ctypes.c_uint], ctypes.c_ssize_t),
+        ('sendfile', [ctypes.c_int, ctypes.c_int, ctypes.c_void_p, ctypes.c_size_t], ctypes.c_ssize_t),
+        ('renameat2', [ctypes.c_int, ctypes.c_char_p, ctypes.c_int, ctypes.c_char_p, ctypes.c_uint], ctypes.c_int)
+    ]
+
+    for name, argtypes, restype in signatures:
+        function = getattr(libc, name, None)
+        if function is not None:
+            function.argtypes = argtypes
+            function.restype = restype
+            _libc_functions[name] = function
+
+    return _libc_functions
+
+
+def _is_same(source, dest, checksum=False, link=False):
+    try:
+        dest_stat = os.stat(dest)
+    except OSError:
+        return False
+
+    source_stat = os.stat(source)
+    if source_stat.st_ino != 0 and source_stat.st_ino == dest_stat.st_ino and source_stat.st_dev == dest_stat.st_dev:
+        # A hard link is only up to date where one is wanted, otherwise it is replaced by a copy.
+        return link
+
+    if source_stat.st_size != dest_stat.st_size:
+        return False
+
+    if checksum:
+        return file_digest(source) == file_digest(dest)
+
+    return int(source_stat.st_mtime) == int(dest_stat.st_mtime)
+
+
+def _clone(source_fd, dest_fd):
+    # Copy-on-write filesystems (btrfs, xfs) share the blocks instead of copying them.
+    if fcntl is None or not sys.platform.startswith('linux'):
+        return False
+
+    try:
+        fcntl.ioctl(dest_fd, FICLONE, source_fd)
+    except (IOError, OSError):
+        return False
+
+    return True
+
+
+def _kernel_copy(source_fd, dest_fd, remaining):
+    functions = _get_libc_functions()
+
+    # Both calls advance the file offsets, so whatever is left over can be copied
+    # by the next method or the plain read/write loop from the current position.
+    for name in ['copy_file_range', 'sendfile']:
+        function = functions.get(name)
+        if function is None:
+            continue
+
+        while remaining > 0:
+            if name == 'copy_file_range':
+                copied = function(source_fd, None, dest_fd, None, min(remaining, KERNEL_CHUNK_SIZE), 0)
+            else:
+                copied = function(dest_fd, source_fd, None, min(remaining, KERNEL_CHUNK_SIZE))
+
+            if copied == 0:
+                return
+            elif copied < 0:
+                break
+
+            remaining -= copied
+
+        if remaining <= 0:
+            return
+
+
+def copy_file(source, dest):
+    binary = getattr(os, 'O_BINARY', 0)
+    source_fd = os.open(source, os.O_RDONLY | binary)
+    try:
+        dest_fd = os.open(dest, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | binary, 0666)
+        try:
+            if not _clone(source_fd, dest_fd):
+                _kernel_copy(source_fd, dest_fd, os.fstat(source_fd).st_size)
+
+                while True:
+                    data = os.read(source_fd, COPY_CHUNK_SIZE)
+                    if not data:
+                        break
+
+                    while data:
+                        data = data[os.write(dest_fd, data):]
+        finally:
+            os.close(dest_fd)
+    finally:
+        os.close(source_fd)
+
+    copystat(source, dest)
+
+
+def _encode_path(path):
+    if isinstance(path, unicode):
+        return path.encode(sys.getfilesystemencoding() or 'utf-8')
+    return path
+
+
+def exchange(first, second):
+    # Swaps two paths in one step (Linux 3.15+), returns False where that is not possible.
+    function = _get_libc_functions().get('renameat2')
+    if function is None:
+        return False
+
+    return function(AT_FDCWD, _encode_path(first), AT_FDCWD, _encode_path(second), RENAME_EXCHANGE) == 0
+
+
+def sync_file(source, dest, link=False, checksum=False):
+    if _is_same(source, dest, checksum, link):
+        return False
+
+    if os.path.lexists(dest):
+        os.remove(dest)
+
+    if link:
+        try:
+            os.link(source, dest)
+            return True
+        except (AttributeError, OSError):
+            pass
+
+    copy_file(source, dest)
+    return True
+
+
+def ensure_folder(path):
+    if not os.path.isdir(path) or os.path.islink(path):
+        if os.path.lexists(path):
+            os.remove(path)
+        os.makedirs(path)
+
+
+def remove_stale(dest, wanted):
+    removed = []
+
+    for root, dirs, files in os.walk(dest, topdown=False):
+        for f in files:
+            path = os.path.join(root, f)
+            if path not in wanted:
+                os.remove(path)
+                removed.append(path)
+
+        for d in dirs:
+            path = os.path.join(root, d)
+            if path not in wanted and os.path.isdir(path) and not os.listdir(path):
+                os.rmdir(path)
+
+    return removed
+
+
+def sync_tree(source, dest, link=False, checksum=False, skip=(), keep=()):
+    # skip are files of the source that are left out, keep are files of dest that are not removed.
+    wanted = set(keep)
+    changed = []
+
+    # Linked folders are copied like copytree did, e.g. the shared files of a test build.
+    for root, dirs, files in os.walk(source, followlinks=True):
+        target_root = os.path.normpath(os.path.join(dest, os.path.relpath(root, source)))
+        wanted.add(target_root)
+        ensure_folder(target_root)
+
+        for f in files:
+            if os.path.join(root, f) in skip:
+                continue
+
+            dest_path = os.path.join(target_root, f)
+            wanted.add(dest_path)
+
+            if sync_file(os.path.join(root, f), dest_path, link, checksum):
+                changed.append(dest_path)
+
+    return changed + remove_stale(dest, wanted)
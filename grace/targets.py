@@ -0,0 +1,92 @@
+from error import Error, TargetError
+from multiprocessing.pool import ThreadPool
+import sys
+import threading
+import time
+import traceback
+
+
+_output_lock = threading.Lock()
+
+
+def target_list(value, key):
+    # A single target or a list of them, e.g. for the deployment_path or the upload url.
+    if isinstance(value, basestring):
+        return [value]
+
+    if not isinstance(value, list) or len(value) == 0 or not all(isinstance(target, basestring) for target in value):
+        raise TargetError('The ' + key + ' option has to be a string or a non-empty list of strings.')
+
+    return value
+
+
+def _print(msg):
+    with _output_lock:
+        sys.stdout.write(msg + '\n')
+        sys.stdout.flush()
+
+
+def _is_transient(error):
+    # A missing setting, a missing file or rejected credentials fail the same way every time,
+    # only failures of the network or the target itself are worth another attempt.
+    if isinstance(error, Error):
+        return error.transient
+
+    return isinstance(error, EnvironmentError)
+
+
+def _attempt(function, target, retries, delay):
+    # Returns the time it took and None, or the exception info of the last failed attempt.
+    start = time.time()
+    attempt = 0
+    while True:
+        try:
+            function(target)
+            return (time.time() - start, attempt + 1, None)
+        except Exception:
+            error = sys.exc_info()
+
+        if attempt >= retries or not _is_transient(error[1]):
+            return (time.time() - start, attempt + 1, error)
+
+        time.sleep(delay * (2 ** attempt))
+        attempt += 1
+
+
+def _message(error):
+    if isinstance(error[1], Error):
+        return error[1].msg
+
+    return ''.join(traceback.format_exception(*error))
+
+
+def run_targets(action, targets, function, jobs=1, retries=0, delay=1.0):
+    # Every target is handled at the same time, so the slowest one sets the total time instead of the sum.
+    if len(targets) == 1:
+        duration, attempts, error = _attempt(function, targets[0], retries, delay)
+        if error is not None:
+            raise error[0], error[1], error[2]
+        return
+
+    jobs = max(1, min(jobs, len(targets)))
+    if jobs == 1:
+        results = [_attempt(function, target, retries, delay) for target in targets]
+    else:
+        pool = ThreadPool(jobs)
+        try:
+            # Without a timeout the wait can not be interrupted with Ctrl+C.
+            results = pool.map_async(lambda target: _attempt(function, target, retries, delay), targets).get(365 * 24 * 3600)
+        finally:
+            pool.close()
+
+    failures = []
+    for target, (duration, attempts, error) in zip(targets, results):
+        tries = '' if attempts == 1 else ', %d attempts' % attempts
+        if error is None:
+            _print('  %s %s: done (%.2fs%s)' % (action, target, duration, tries))
+        else:
+            _print('  %s %s: FAILED (%.2fs%s)' % (action, target, duration, tries))
+            failures.append(target + ':\n' + _message(error))
+
+    if len(failures) > 0:
+        raise TargetError('%d of %d targets failed:\n\n' % (len(failures), len(targets)) + '\n\n'.join(failures))
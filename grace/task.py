@@ -6,27 +6,49 @@ from create import New
 from doc import Doc
 from update import Update
 from upload import Upload
+from watch import Watch
+from scheduler import StageScheduler
+from workers import start_workers, stop_workers
+from taskstate import TaskState
+from targets import target_list
 import os
-from error import UnknownCommandError
+from error import Error, UnknownCommandError, TestError
+from multiprocessing.pool import ThreadPool
 import sys
+import threading
+import traceback
+
+
+UPDATE_COMMANDS = {
+    'update': (False, None),
+    'update:libs': (False, 'libs'),
+    'update:html': (False, 'html'),
+    'update:config': (False, 'config'),
+    'update:javascript': (False, 'javascript'),
+    'update:css': (False, 'css'),
+    'update:test': (True, None),
+    'update:test:libs': (True, 'libs'),
+    'update:test:html': (True, 'html'),
+    'update:test:javascript': (True, 'javascript')
+}
+
+TEST_COMMANDS = ['test', 'test:deploy', 'test:zip', 'test:upload']
+
+COMMANDS = ['clean', 'build', 'jsdoc', 'deploy', 'zip', 'upload', 'watch'] + TEST_COMMANDS + UPDATE_COMMANDS.keys()
 
 
 class Task(object):
     def __init__(self, tasks, config, module):
-        self._build = False
-        self._jsdoc = False
-        self._test = False
-        self._deploy = False
-        self._zip = False
-        self._clean = False
-        self._bad = False
-        self._update = False
+        self._commands = []
+        self._test_cases = None
         self._update_test = False
         self._update_target = None
-        self._upload = False
 
         self._config = config
         self._module = module
+        self._output_lock = threading.Lock()
+        self._state = None
+        self._state_lock = threading.Lock()
 
         self._config['build'] = False
         self._config['test'] = False
@@ -34,182 +56,378 @@ class Task(object):
         if len(tasks) == 0:
             raise UnknownCommandError('Need to have at least one task to operate on')
 
-        task = tasks[0]
-        if task == 'test' or task == 'test:deploy' or task == 'test:zip':
-            if len(tasks) > 1:
-                self._test_cases = tasks[1].split(':')
-            else:
-                self._test_cases = None
-        else:
-            if len(tasks) > 1:
-                print 'Only the first argument will be executed. All other arguments are being ignored (except "st" if supplied")'
-
-        if task == 'clean':
-            self._clean = True
-        else:
-            if task == 'build':
-                self._build = True
-            if task == 'jsdoc':
-                self._jsdoc = True
-            if task == 'deploy':
-                self._build = True
-                self._deploy = True
-            if task == 'zip':
-                self._build = True
-                self._zip = True
-            if task == 'test':
-                self._test = True
-            if task == 'test:deploy':
-                self._test = True
-                self._deploy = True
-            if task == 'test:zip':
-                self._test = True
-                self._zip = True
-            if task == 'update':
-                self._update = True
-            if task == 'update:libs':
-                self._update = True
-                self._update_target = 'libs'
-            if task == 'update:html':
-                self._update = True
-                self._update_target = 'html'
-            if task == 'update:config':
-                self._update = True
-                self._update_target = 'config'
-            if task == 'update:javascript':
-                self._update = True
-                self._update_target = 'javascript'
-            if task == 'update:css':
-                self._update = True
-                self._update_target = 'css'
-            if task == 'update:test':
-                self._update = True
-                self._update_test = True
-            if task == 'update:test:libs':
-                self._update = True
-                self._update_test = True
-                self._update_target = 'libs'
-            if task == 'update:test:html':
-                self._update = True
-                self._update_test = True
-                self._update_target = 'html'
-            if task == 'update:test:javascript':
-                self._update = True
-                self._update_test = True
-                self._update_target = 'javascript'
-            if task == 'upload':
-                self._build = True
-                self._zip = True
-                self._upload = True
-
-            if not self._build and not self._test and not self._deploy and not self._zip and not self._jsdoc and not self._update and not self._upload:
+        # Several commands can be given at once, a test command may be followed by its test cases (e.g. "test a:b").
+        i = 0
+        while i < len(tasks):
+            task = tasks[i]
+            if task not in COMMANDS:
                 raise UnknownCommandError('The provided argument(s) could not be recognized by the manage.py script: ' + ', '.join(tasks))
 
+            if task not in self._commands:
+                self._commands.append(task)
+
+            if task in TEST_COMMANDS and i + 1 < len(tasks) and tasks[i + 1] not in COMMANDS:
+                if self._test_cases is None:
+                    self._test_cases = []
+                for test_case in tasks[i + 1].split(':'):
+                    if test_case not in self._test_cases:
+                        self._test_cases.append(test_case)
+                i += 1
+
+            i += 1
+
+        updates = [command for command in self._commands if command in UPDATE_COMMANDS]
+        if len(updates) > 1:
+            raise UnknownCommandError('Only one update command can be executed at a time: ' + ', '.join(updates))
+        elif len(updates) == 1:
+            self._update_test, self._update_target = UPDATE_COMMANDS[updates[0]]
+
+        self._test_deploy = 'test:deploy' in self._commands
+        self._test_zip = 'test:zip' in self._commands or 'test:upload' in self._commands
+
+    def _requested(self, *commands):
+        return any(command in self._commands for command in commands)
+
+    def _tasks(self):
+        # (name, function, dependencies) like the build stages, the tasks that do not
+        # depend on each other run at the same time and shared ones run only once.
+        tasks = []
+
+        if self._requested('clean'):
+            tasks.append(('clean', clean, []))
+
+        if self._requested(*UPDATE_COMMANDS.keys()):
+            tasks.append(('update', lambda: self.exec_update(self._update_target), []))
+
+        if self._requested('build', 'deploy', 'zip', 'upload'):
+            tasks.append(('build', self.exec_build, []))
+        if self._requested('deploy'):
+            tasks.append(('deploy', lambda: self.exec_deploy(None), ['build']))
+        if self._requested('zip', 'upload'):
+            tasks.append(('zip', lambda: self.exec_zip(None), ['build']))
+        if self._requested('upload'):
+            tasks.append(('upload', lambda: self.exec_upload(None), ['zip']))
+
+        if self._requested(*TEST_COMMANDS):
+            tasks.append(('test', self.exec_test_cases, []))
+        if self._requested('test:upload'):
+            tasks.append(('test:upload', lambda: self.exec_upload(self._test_cases), ['test']))
+
+        if self._requested('jsdoc'):
+            tasks.append(('jsdoc', self.exec_jsdoc, []))
+
+        # Watch never returns, it comes last.
+        if self._requested('watch'):
+            tasks.append(('watch', self.exec_watch, [name for name, function, dependencies in tasks]))
+
+        # Clean and update change the project for everything else, they run first.
+        names = [name for name, function, dependencies in tasks]
+        first = [name for name in ['clean', 'update'] if name in names]
+
+        ordered = []
+        for name, function, dependencies in tasks:
+            before = first[:first.index(name)] if name in first else first
+            ordered.append((name, function, dependencies + [d for d in before if d not in dependencies]))
+
+        return ordered
+
     def execute(self):
-        if self._clean:
-            clean()
-            return
+        scheduler = StageScheduler(self._tasks(), self._config['jobs'])
+
+        start_workers(self._config['jobs'])
+        try:
+            times = scheduler.run()
+        finally:
+            stop_workers()
 
-        if self._build:
-            self.exec_build()
+        if self._config['show_times'] and len(times) > 1:
+            self._print('Task times: ' + scheduler.format_times(times))
 
-            self._config['build'] = True
+    def _task_config(self, test):
+        # Every task gets its own copy, the project and the tests may be handled at the same time.
+        config = dict(self._config)
+        config['build'] = not test
+        config['test'] = test
 
-            if self._deploy:
-                self.exec_deploy(None)
-            if self._zip:
-                self.exec_zip(None)
+        return config
 
-                if self._upload:
-                    self.exec_upload()
+    def _get_state(self):
+        if not self._config['incremental']:
+            return None
 
-        if self._test:
-            if self._test_cases is None:
-                self._test_cases = self._config['test_cases']
+        with self._state_lock:
+            if self._state is None:
+                self._state = TaskState(os.path.join(os.getcwd(), 'build', '.cache', 'tasks.json'))
 
-            if self._test_cases is None:
-                self._test_cases = []
-                for test_case in os.listdir(os.path.join(os.getcwd(), 'test', 'tests')):
-                    self._test_cases.append(test_case[5:-3])
+        return self._state
+
+    def _run_task(self, task, description, declare, function):
+        # declare returns the (settings, inputs, outputs) of the task, it is skipped while
+        # the content of all of them is the same as after its last run.
+        state = self._get_state()
+        try:
+            settings, inputs, outputs = declare()
+        except (Error, KeyError):
+            # The task reports the broken configuration itself.
+            state = None
+
+        if state is None:
+            function()
+            return True
+
+        settings['type'] = self._config['type']
+        inputs = inputs + self._plugin_sources()
+        if state.is_current(task, settings, inputs, outputs):
+            self._print(description + ': UP-TO-DATE')
+            return False
+
+        inputs_digest = state.digest(inputs)
+        state.invalidate(task)
+
+        function()
+
+        state.update(task, settings, inputs_digest, outputs)
+        try:
+            state.save()
+        except (IOError, OSError):
+            self._print('Could not write the task state.')
+
+        return True
+
+    def _plugin_sources(self):
+        # The classes of the plugin run the tasks, a change of its code changes their results as well.
+        if self._module is None:
+            return []
+
+        return [os.path.dirname(os.path.abspath(self._module.__file__))]
+
+    def _artefact_name(self, testname):
+        if testname is None:
+            return self._config['name']
+
+        return self._config['name'] + '_' + testname
+
+    def _task_key(self, task, testname):
+        if testname is None:
+            return task
+
+        return task + ':' + testname
+
+    def _describe(self, action, testname):
+        if testname is None:
+            return action + ' of the project'
+
+        return action + ' of the test ' + testname
+
+    def _deploy_io(self, testname):
+        cwd = os.getcwd()
+        name = self._artefact_name(testname)
+        paths = target_list(self._config['deployment_path'], 'deployment_path')
+
+        settings = {
+            'deployment_path': paths,
+            'deploy_mode': self._config['deploy_mode'],
+            'sync_checksum': self._config['sync_checksum']
+        }
+
+        return (settings, [os.path.join(cwd, 'build', name)], [os.path.join(path, name) for path in paths])
+
+    def _zip_io(self, testname):
+        cwd = os.getcwd()
+        name = self._artefact_name(testname)
+        source = self._config['build_path'] if testname is None else os.path.join(cwd, 'build', name)
+
+        settings = {
+            'version': self._config['version'],
+            'zip_path': self._config.get('zip_path'),
+            'zip_compression': self._config['zip_compression'],
+            'zip_level': self._config['zip_level'],
+            'tar_format': self._config['tar_format']
+        }
+
+        files = [name + '_v' + self._config['version'] + '.zip']
+        if self._config['tar_format'] is not None:
+            files.append(name + '_v' + self._config['version'] + '.' + self._config['tar_format'])
 
-            for test_case in self._test_cases:
-                self.exec_test(test_case)
+        outputs = [os.path.join(cwd, 'build', f) for f in files]
+        if 'zip_path' in self._config:
+            outputs.extend(os.path.join(self._config['zip_path'], f) for f in files)
+
+        return (settings, [source], outputs)
 
-                self._config['test'] = True
+    def _test_io(self, testname):
+        cwd = os.getcwd()
+        inputs = [
+            os.path.join(cwd, 'test', 'tests', 'test_' + testname + '.js'),
+            os.path.join(cwd, 'test', 'javascript'),
+            os.path.join(cwd, 'test', 'lib'),
+            os.path.join(cwd, 'test', 'index.html'),
+            os.path.join(cwd, 'src', 'javascript'),
+            os.path.join(cwd, 'assets')
+        ]
 
-                if self._deploy:
-                    self.exec_deploy(test_case)
-                if self._zip:
-                    self.exec_zip(test_case)
+        return ({'test_shared_files': self._config['test_shared_files']}, inputs, [os.path.join(cwd, 'build', self._artefact_name(testname))])
 
-        if self._jsdoc:
-            self.exec_jsdoc()
+    def _jsdoc_io(self):
+        cwd = os.getcwd()
+        outputs = [os.path.join(cwd, 'build', 'JSDocs')]
+        if 'doc_path' in self._config:
+            outputs.append(os.path.join(self._config['doc_path'], self._config['name']))
 
-        if self._update:
-            self.exec_update(self._update_target)
+        return ({'doc_path': self._config.get('doc_path')}, [os.path.join(cwd, 'src', 'javascript')], outputs)
+
+    def exec_test_cases(self):
+        if self._test_cases is None:
+            self._test_cases = self._config['test_cases']
+
+        if self._test_cases is None:
+            self._test_cases = []
+            for test_case in os.listdir(os.path.join(os.getcwd(), 'test', 'tests')):
+                self._test_cases.append(test_case[5:-3])
+
+        self._exec_test_cases(self._test_cases)
+
+    def _exec_test_cases(self, test_cases):
+        jobs = min(self._config['test_jobs'], len(test_cases))
+
+        if jobs <= 1:
+            errors = [self._exec_test_case(test_case) for test_case in test_cases]
+        else:
+            pool = ThreadPool(jobs)
+            try:
+                # Without a timeout the wait can not be interrupted with Ctrl+C.
+                errors = pool.map_async(self._exec_test_case, test_cases).get(365 * 24 * 3600)
+            finally:
+                pool.close()
+
+        failures = [(test_case, error) for test_case, error in zip(test_cases, errors) if error is not None]
+        if len(failures) > 0:
+            summary = '%d of %d test cases failed:\n\n' % (len(failures), len(test_cases))
+            raise TestError(summary + '\n\n'.join(test_case + ':\n' + error for test_case, error in failures))
+
+    def _exec_test_case(self, test_case):
+        try:
+            self.exec_test(test_case)
+
+            if self._test_deploy:
+                self.exec_deploy(test_case)
+            if self._test_zip:
+                self.exec_zip(test_case)
+        except Error as e:
+            return e.msg
+        except Exception:
+            return traceback.format_exc()
+
+        return None
+
+    def _print(self, msg):
+        # Tasks and test cases run in parallel threads, keep their lines from interleaving.
+        with self._output_lock:
+            sys.stdout.write(msg + '\n')
+            sys.stdout.flush()
 
     def exec_build(self):
+        config = self._task_config(False)
+
         if self._module is not None:
             try:
-                b = getattr(self._module.plugin, 'Build')(self._config)
+                b = getattr(self._module.plugin, 'Build')(config)
             except AttributeError:
-                b = Build(self._config)
+                b = Build(config)
         else:
-            b = Build(self._config)
+            b = Build(config)
 
         b.run()
 
-        print 'Successfully built the project.'
+        self._print('Successfully built the project.')
+
+    def exec_watch(self):
+        config = self._task_config(False)
 
-    def exec_deploy(self, testname):
         if self._module is not None:
             try:
-                d = getattr(self._module.plugin, 'Deploy')(self._config)
+                b = getattr(self._module.plugin, 'Build')(config)
             except AttributeError:
-                d = Deploy(self._config)
+                b = Build(config)
         else:
-            d = Deploy(self._config)
+            b = Build(config)
 
-        d.run(testname)
+        w = Watch(config, b)
+        w.run()
+
+    def exec_deploy(self, testname):
+        if not self._run_task(self._task_key('deploy', testname), self._describe('Deploy', testname), lambda: self._deploy_io(testname), lambda: self._deploy(testname)):
+            return
 
         if testname is not None:
-            print 'Successfully deployed the test: ' + testname + '.'
+            self._print('Successfully deployed the test: ' + testname + '.')
         else:
-            print 'Successfully deployed the project.'
+            self._print('Successfully deployed the project.')
+
+    def _deploy(self, testname):
+        config = self._task_config(testname is not None)
 
-    def exec_zip(self, testname):
         if self._module is not None:
             try:
-                z = getattr(self._module.plugin, 'Zip')(self._config)
+                d = getattr(self._module.plugin, 'Deploy')(config)
             except AttributeError:
-                z = Zip(self._config)
+                d = Deploy(config)
         else:
-            z = Zip(self._config)
+            d = Deploy(config)
 
-        z.run(testname)
+        d.run(testname)
+
+    def exec_zip(self, testname):
+        if not self._run_task(self._task_key('zip', testname), self._describe('Zip', testname), lambda: self._zip_io(testname), lambda: self._zip(testname)):
+            return
 
         if testname is not None:
-            print 'Successfully zipped the test: ' + testname + '.'
+            self._print('Successfully zipped the test: ' + testname + '.')
         else:
-            print 'Successfully zipped the project.'
+            self._print('Successfully zipped the project.')
+
+    def _zip(self, testname):
+        config = self._task_config(testname is not None)
 
-    def exec_test(self, testname):
         if self._module is not None:
             try:
-                t = getattr(self._module.plugin, 'Test')(self._config)
+                z = getattr(self._module.plugin, 'Zip')(config)
             except AttributeError:
-                t = Test(self._config)
+                z = Zip(config)
         else:
-            t = Test(self._config)
+            z = Zip(config)
 
-        t.run(testname)
+        z.run(testname)
 
-        if testname is not None:
-            print 'Successfully built the test: ' + testname + '.'
+    def exec_test(self, testname):
+        if testname is None:
+            self._test(testname)
+            self._print('Successfully built the test.')
+            return
+
+        if self._run_task(self._task_key('test', testname), self._describe('Build', testname), lambda: self._test_io(testname), lambda: self._test(testname)):
+            self._print('Successfully built the test: ' + testname + '.')
+
+    def _test(self, testname):
+        config = self._task_config(True)
+
+        if self._module is not None:
+            try:
+                t = getattr(self._module.plugin, 'Test')(config)
+            except AttributeError:
+                t = Test(config)
         else:
-            print 'Successfully built the test.'
+            t = Test(config)
+
+        t.run(testname)
 
     def exec_jsdoc(self):
+        if not self._run_task('jsdoc', 'JSDoc documentation', self._jsdoc_io, self._jsdoc):
+            return
+
+        self._print('Successfully built the JSDoc documentation.')
+
+    def _jsdoc(self):
         if self._module is not None:
             try:
                 d = getattr(self._module.plugin, 'Doc')(self._config)
@@ -220,20 +438,23 @@ class Task(object):
 
         d.run()
 
-        print 'Successfully built the JSDoc documentation.'
+    def exec_upload(self, testnames):
+        config = self._task_config(testnames is not None)
 
-    def exec_upload(self):
         if self._module is not None:
             try:
-                u = getattr(self._module.plugin, 'Upload')(self._config)
+                u = getattr(self._module.plugin, 'Upload')(config)
             except AttributeError:
-                u = Upload(self._config)
+                u = Upload(config)
         else:
-            u = Upload(self._config)
+            u = Upload(config)
 
-        u.run()
+        u.run(testnames)
 
-        print 'Successfully uploaded the project.'
+        if testnames is not None:
+            self._print('Successfully uploaded the tests: ' + ', '.join(testnames) + '.')
+        else:
+            self._print('Successfully uploaded the project.')
 
     def exec_update(self, target):
         print 'Please be aware that an update will replace anything you have done to the files.'
@@ -0,0 +1,102 @@
+from utils import load_json, save_json, path_key, file_digest
+import hashlib
+import os
+import threading
+
+
+STATE_VERSION = 1
+
+
+class TaskState(object):
+    def __init__(self, path):
+        self._path = path
+        self._lock = threading.Lock()
+
+        data = load_json(path, {})
+        if data.get('version') != STATE_VERSION:
+            data = {}
+
+        self._tasks = data.get('tasks', {})
+        self._files = data.get('files', {})
+        self._saved = self._modified()
+
+    def _modified(self):
+        try:
+            return os.stat(self._path).st_mtime
+        except OSError:
+            return 0
+
+    def _file_digest(self, path):
+        # Like git, a file is only read again when its size or modification time changed.
+        # A file changed in the same tick as the state was saved keeps its modification
+        # time, so those entries are not trusted and the file is read again.
+        stat = os.stat(path)
+        key = path_key(path)
+
+        with self._lock:
+            cached = self._files.get(key)
+            saved = self._saved
+
+        if cached is not None and cached[0] == stat.st_mtime and cached[1] == stat.st_size and cached[0] < saved:
+            return cached[2]
+
+        digest = file_digest(path)
+        with self._lock:
+            self._files[key] = [stat.st_mtime, stat.st_size, digest]
+
+        return digest
+
+    def digest(self, paths):
+        # One digest of the content of all files below the paths, missing paths count as well.
+        h = hashlib.sha1()
+
+        for path in paths:
+            h.update(path_key(path).encode('utf-8') + '\0')
+
+            if os.path.isfile(path):
+                h.update('file\0' + self._file_digest(path) + '\0')
+            elif os.path.isdir(path):
+                h.update('dir\0')
+                for root, dirs, files in os.walk(path, followlinks=True):
+                    dirs.sort()
+                    for f in sorted(files):
+                        file_path = os.path.join(root, f)
+                        h.update(path_key(os.path.relpath(file_path, path)).encode('utf-8') + '\0' + self._file_digest(file_path) + '\0')
+            else:
+                h.update('missing\0')
+
+        return h.hexdigest()
+
+    def is_current(self, task, settings, inputs, outputs):
+        with self._lock:
+            record = self._tasks.get(task)
+
+        if record is None or record['settings'] != settings:
+            return False
+
+        try:
+            return record['inputs'] == self.digest(inputs) and record['outputs'] == self.digest(outputs)
+        except OSError:
+            return False
+
+    def invalidate(self, task):
+        with self._lock:
+            if task in self._tasks:
+                del self._tasks[task]
+
+    def update(self, task, settings, inputs_digest, outputs):
+        outputs_digest = self.digest(outputs)
+
+        with self._lock:
+            self._tasks[task] = {
+                'settings': settings,
+                'inputs': inputs_digest,
+                'outputs': outputs_digest
+            }
+
+    def save(self):
+        with self._lock:
+            files = dict((key, value) for key, value in self._files.items() if os.path.exists(key))
+            self._files = files
+            save_json(self._path, {'version': STATE_VERSION, 'tasks': self._tasks, 'files': files})
+            self._saved = self._modified()
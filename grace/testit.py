@@ -1,14 +1,31 @@
 import os
 from error import FileNotFoundError, CreateFolderError, RemoveFolderError, FileNotWritableError, RemoveFileError
-import re
 from shutil import rmtree, copy2, copytree
+from requiregraph import RequireGraph
+from sync import sync_tree
 import sys
+import threading
+
+
+_shared_lock = threading.Lock()
+_shared_trees = set()
+
+
+def _materialise(source, shared):
+    # All test cases of a run link to the same copy, only the first one has to update it.
+    with _shared_lock:
+        if shared not in _shared_trees:
+            sync_tree(source, shared)
+            _shared_trees.add(shared)
+
+    return shared
 
 
 class Test(object):
     def __init__(self, config):
         self._cwd = os.getcwd()
         self._config = config
+        self._require_graph = None
 
     def run(self, testname):
         if testname is None:
@@ -40,10 +57,7 @@ class Test(object):
             raise CreateFolderError('Could not create the test folder: ' + build_path)
 
     def _build_javascript(self, build_path, js_source_path):
-        self._js_string_lines = []
-
         dest = os.path.join(build_path, 'test.js')
-        js_string_lines = self._concat_javascript(js_source_path)
 
         if os.path.exists(dest):
             try:
@@ -51,44 +65,41 @@ class Test(object):
             except:
                 raise RemoveFileError('Could not delete the existing javascript test file.')
 
-
         try:
             f = open(dest, 'w+')
         except:
             raise FileNotWritableError('Could not write the javascript test file.')
 
-        js_string = ''.join(js_string_lines)
-        f.write(js_string)
-        f.close()
+        try:
+            for chunk in self._concat_javascript(js_source_path):
+                f.write(chunk.encode('utf-8'))
+        finally:
+            f.close()
 
     def _concat_javascript(self, js_source_path):
-        f = None
-        lines = []
-
-        try:
-            f = open(js_source_path)
-        except:
-            raise FileNotFoundError('The specified file does not exist: ', js_source_path)
+        if self._require_graph is None:
+            self._require_graph = RequireGraph.shared(os.path.join(self._cwd, 'build', '.cache', 'requires.json'))
 
         self._included_js_files = []
+        self._included_js_set = set()
         try:
-            lines = self._gather_javascript_lines(f)
-        except FileNotFoundError:
-            raise
+            for chunk in self._gather_javascript_lines(js_source_path):
+                yield chunk
         finally:
-            f.close()
-
-        return lines
-
-    def _gather_javascript_lines(self, f):
-        lines = []
+            try:
+                self._require_graph.save()
+            except (IOError, OSError):
+                print 'Could not write the javascript require cache.'
 
-        for line in f:
-            match = re.match('\/\/= require ([a-zA-Z\/-_]+)', line)
-            if match:
-                sub_f = None
+    def _gather_javascript_lines(self, source):
+        try:
+            chunks = self._require_graph.chunks(source)
+        except (IOError, OSError):
+            raise FileNotFoundError('The specified file does not exist: ', source)
 
-                path = match.group(1)
+        for kind, value in chunks:
+            if kind == 'require':
+                path = str(value)
                 if sys.platform.startswith('win32'):
                     path = path.replace('/', '\\')
 
@@ -96,25 +107,16 @@ class Test(object):
                 if not os.path.exists(sub_path):
                     sub_path = os.path.join(self._cwd, 'src', 'javascript', path + '.js')
 
-                if sub_path not in self._included_js_files:
+                if sub_path not in self._included_js_set:
                     self._included_js_files.append(sub_path)
+                    self._included_js_set.add(sub_path)
 
-                    try:
-                        sub_f = open(sub_path)
-                    except:
-                        raise FileNotFoundError('The specified file does not exist: ', sub_path)
-
-                    try:
-                        lines = lines + self._gather_javascript_lines(sub_f)
-                    except FileNotFoundError:
-                        raise
-                    finally:
-                        sub_f.close()
+                    for chunk in self._gather_javascript_lines(sub_path):
+                        yield chunk
             else:
-                lines.append(line)
+                yield value
 
-        lines.append('\n')
-        return lines
+        yield '\n'
 
     def _build_html(self, build_path):
         source = os.path.join(self._cwd, 'test', 'index.html')
@@ -140,6 +142,13 @@ class Test(object):
         if not os.path.exists(source):
             return
 
+        if self._config['test_shared_files'] != 'copy':
+            try:
+                self._link_shared(source, dest)
+            except:
+                raise FileNotWritableError('Could not link all the libraries.')
+            return
+
         if os.path.exists(dest):
             try:
                 rmtree(dest)
@@ -158,6 +167,13 @@ class Test(object):
         if not os.path.exists(source):
             return
 
+        if self._config['test_shared_files'] != 'copy':
+            try:
+                self._link_shared(source, dest)
+            except:
+                raise FileNotWritableError('Could not link all asset files')
+            return
+
         if os.path.exists(dest):
             try:
                 rmtree(dest)
@@ -168,3 +184,21 @@ class Test(object):
             copytree(source, dest)
         except:
             raise FileNotWritableError('Could not copy all asset files')
+
+    def _link_shared(self, source, dest):
+        name = os.path.relpath(source, self._cwd).replace(os.sep, '_')
+        shared = _materialise(source, os.path.join(self._cwd, 'build', '.cache', 'test_shared', name))
+
+        if os.path.islink(dest):
+            os.remove(dest)
+        elif os.path.exists(dest):
+            rmtree(dest)
+
+        if self._config['test_shared_files'] == 'symlink':
+            try:
+                os.symlink(shared, dest)
+                return
+            except (AttributeError, NotImplementedError, OSError):
+                pass
+
+        sync_tree(shared, dest, link=True)
@@ -0,0 +1,131 @@
+import mimetypes
+import os
+import re
+import sys
+import time
+import uuid
+import requests
+
+
+READ_SIZE = 64 * 1024
+RANGE_PATTERN = re.compile('bytes=(\d+)-(\d+)')
+
+
+class Progress(object):
+    def __init__(self, name, total, done=0, show=True):
+        self._name = name
+        self._total = total
+        self._done = done
+        self._shown = None
+        self._interactive = show and sys.stdout.isatty()
+
+    def update(self, done):
+        self._done = done
+        percent = 100 if self._total == 0 else int(self._done * 100 / self._total)
+        if percent == self._shown:
+            return
+
+        self._shown = percent
+        if self._interactive:
+            sys.stdout.write('\rUploading %s: %3d%% (%.1f of %.1f MB)' % (self._name, percent, self._done / 1048576.0, self._total / 1048576.0))
+            sys.stdout.flush()
+
+    def add(self, size):
+        self.update(self._done + size)
+
+    def finish(self):
+        self.update(self._total)
+        if self._interactive:
+            sys.stdout.write('\n')
+            sys.stdout.flush()
+
+
+class MultipartFile(object):
+    # A file-like multipart/form-data body, requests streams it with a Content-Length
+    # instead of building the whole body in memory.
+    def __init__(self, field, path, progress=None):
+        self._boundary = uuid.uuid4().hex
+        self._progress = progress
+
+        filename = os.path.basename(path)
+        if isinstance(filename, unicode):
+            filename = filename.encode('utf-8')
+
+        content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        self._head = (
+            '--' + self._boundary + '\r\n' +
+            'Content-Disposition: form-data; name="' + field + '"; filename="' + filename.replace('"', '\\"') + '"\r\n' +
+            'Content-Type: ' + content_type + '\r\n\r\n'
+        )
+        self._tail = '\r\n--' + self._boundary + '--\r\n'
+
+        self._size = os.path.getsize(path)
+        self._file = open(path, 'rb')
+        self._parts = [self._head, self._file, self._tail]
+
+    @property
+    def content_type(self):
+        return 'multipart/form-data; boundary=' + self._boundary
+
+    def __len__(self):
+        return len(self._head) + self._size + len(self._tail)
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = len(self)
+
+        data = []
+        while size > 0 and len(self._parts) > 0:
+            part = self._parts[0]
+            if isinstance(part, str):
+                chunk = part[:size]
+                if len(chunk) == len(part):
+                    self._parts.pop(0)
+                else:
+                    self._parts[0] = part[len(chunk):]
+            else:
+                chunk = part.read(min(size, READ_SIZE))
+                if len(chunk) == 0:
+                    self._parts.pop(0)
+                    continue
+
+                if self._progress is not None:
+                    self._progress.add(len(chunk))
+
+            data.append(chunk)
+            size -= len(chunk)
+
+        return ''.join(data)
+
+    def close(self):
+        self._file.close()
+
+
+def is_retryable(response):
+    return response.status_code >= 500 or response.status_code == 429
+
+
+def with_retries(request, retries=5, delay=1.0):
+    # Connection errors and server errors are retried with an exponential backoff.
+    attempt = 0
+    while True:
+        try:
+            response = request()
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            if attempt >= retries:
+                raise
+        else:
+            if not is_retryable(response) or attempt >= retries:
+                return response
+
+        time.sleep(delay * (2 ** attempt))
+        attempt += 1
+
+
+def next_offset(response):
+    # The Range header holds the bytes the server has received so far, nothing means none.
+    match = RANGE_PATTERN.match(response.headers.get('Range', ''))
+    if match is None:
+        return 0
+
+    return int(match.group(2)) + 1
@@ -1,10 +1,37 @@
 import os
-from utils import get_path
-from error import MissingKeyError, WrongLoginCredentials, FileNotFoundError, FileUploadError
+from utils import get_path, file_digest, load_json, save_json
+from archive import manifest_path
+from error import MissingKeyError, WrongLoginCredentials, FileNotFoundError, FileUploadError, TargetError
+from transfer import MultipartFile, Progress, is_retryable, next_offset, with_retries
+from targets import run_targets, target_list
+from multiprocessing.pool import ThreadPool
 from pkg_resources import resource_filename
+import copy
+import hashlib
 import requests
 import getpass
 import json
+import threading
+import time
+import traceback
+import zipfile
+
+
+# How long a login is kept when the server sets cookies without an expiry date.
+SESSION_LIFETIME = 3600
+
+_logins_lock = threading.Lock()
+
+
+def credentials_path():
+    return os.path.join(os.path.expanduser('~'), '.gracecredentials')
+
+
+class Artefact(object):
+    def __init__(self, cwd, name, version):
+        self.zip_name = name + '_v' + version + '.zip'
+        self.zip_path = os.path.join(cwd, 'build', self.zip_name)
+        self.digest = None
 
 
 class Upload(object):
@@ -13,6 +40,7 @@ class Upload(object):
         self._root = get_path()
         self._config = config
         self._verify_ssl = True
+        self._output_lock = threading.Lock()
 
         if 'urls' not in self._config:
             raise MissingKeyError('Could not find url settings in either global or local configuration file.')
@@ -20,50 +48,191 @@ class Upload(object):
         if 'upload' not in self._config['urls']:
             raise MissingKeyError('Could not find an upload url in either the global or local configuration file.')
         else:
-            self._upload_url = self._config['upload_url']
+            upload_urls = target_list(self._config['urls']['upload'], 'urls.upload')
 
-        if 'login_url' not in self._config['urls']:
-            self._login_url = self._upload_url
+        # A single login url is used for every upload url, a list names one for each of them.
+        if 'login' not in self._config['urls']:
+            login_urls = upload_urls
         else:
-            self._login_url = self._config['login_url']
+            login_urls = target_list(self._config['urls']['login'], 'urls.login')
+            if len(login_urls) == 1:
+                login_urls = login_urls * len(upload_urls)
+            elif len(login_urls) != len(upload_urls):
+                raise TargetError('The urls.login option needs one url for every upload url.')
 
-        if 'username' not in self._config['urls']:
-            self._username = raw_input('Please provide the username for your upload server (or leave blank if none is required): ')
-        else:
-            self._username = self._config['urls']['username'].encode()
+        self._logins = dict(zip(upload_urls, login_urls))
+        self._upload_urls = upload_urls
+        self._upload_url = upload_urls[0]
+        self._login_url = login_urls[0]
+
+        credentials = self._config.get('credentials', {})
+
+        # Only asked for once a login is needed, a cached login does not need them.
+        # Shared by the uploads to every server, so they are asked for only once.
+        self._credentials = {
+            'username': credentials['username'].encode() if 'username' in credentials else None,
+            'password': credentials['password'].encode() if 'password' in credentials else None
+        }
+        self._credentials_lock = threading.Lock()
 
-        if 'password' not in self._config['urls']:
-            self._password = getpass.getpass('Please provide the password for your upload server (or leave blank if none is required): ')
+        self._session = None
+        self._cached_login = False
+
+    def run(self, testnames=None):
+        if testnames is None:
+            artefacts = [Artefact(self._cwd, self._config['name'], self._config['version'])]
         else:
-            self._password = self._config['urls']['password'].encode()
+            artefacts = [Artefact(self._cwd, self._config['name'] + '_' + testname, self._config['version']) for testname in testnames]
+
+        for artefact in artefacts:
+            if not os.path.exists(artefact.zip_path):
+                raise FileNotFoundError('Could not find the zip file. Please check if "' + artefact.zip_path + '" exists.')
+
+        run_targets('upload', self._upload_urls, lambda url: self._target(url)._run(artefacts), self._config['jobs'], self._config['target_retries'])
+
+    def _target(self, upload_url):
+        # Every server gets its own session and login.
+        target = copy.copy(self)
+        target._upload_url = upload_url
+        target._login_url = self._logins[upload_url]
+        target._output_lock = threading.Lock()
+
+        return target
+
+    def _run(self, artefacts):
+        # The artefacts are copied as well, their digests are set while uploading.
+        artefacts = [copy.copy(artefact) for artefact in artefacts]
+
+        self._session = self._create_session(len(artefacts))
+        try:
+            self._cached_login = self._restore_login()
+            if not self._cached_login:
+                self._login()
+
+            results = self._upload_all(artefacts)
+
+            # The server may have ended a cached login early, those uploads are repeated after logging in again.
+            rejected = [artefact for artefact, r in zip(artefacts, results) if self._is_unauthorized(r)]
+            if self._cached_login and len(rejected) > 0:
+                self._forget_login()
+                self._login()
+                retried = dict(zip([artefact.zip_name for artefact in rejected], self._upload_all(rejected)))
+                results = [retried.get(artefact.zip_name, r) for artefact, r in zip(artefacts, results)]
+        finally:
+            self._session.close()
+
+        self._upload_response(artefacts, results)
+
+    def _create_session(self, connections):
+        # Keep-alive connections are shared by the login and all uploads, one per upload running at the same time.
+        session = requests.Session()
+        session.verify = self._verify_ssl
+
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max(connections, 1))
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+
+        return session
+
+    def _restore_login(self):
+        if not self._config['upload_cache_login']:
+            return False
 
-        self._zip_name = self._config['name'] + '_v' + self._config['version'] + '.zip'
-        self._zip_path = os.path.join(self._cwd, 'build', self._zip_name)
+        # Logins are kept per login url, without a configured username the cached one is used.
+        logins = load_json(credentials_path(), {})
+        login = logins.get(self._login_url) if isinstance(logins, dict) else None
+        if not isinstance(login, dict) or login.get('expires', 0) <= time.time():
+            return False
 
-    def run(self):
-        self._login()
+        with self._credentials_lock:
+            username = self._credentials['username']
+        if username and login.get('username') != username:
+            return False
+
+        for cookie in login.get('cookies', []):
+            self._session.cookies.set(cookie['name'], cookie['value'],
+                domain=cookie['domain'],
+                path=cookie['path'],
+                secure=cookie['secure'],
+                expires=cookie['expires']
+            )
+
+        return True
+
+    def _save_login(self):
+        if not self._config['upload_cache_login'] or len(self._session.cookies) == 0:
+            return
+
+        cookies = []
+        expires = time.time() + SESSION_LIFETIME
+        for cookie in self._session.cookies:
+            cookies.append({
+                'name': cookie.name,
+                'value': cookie.value,
+                'domain': cookie.domain,
+                'path': cookie.path,
+                'secure': cookie.secure,
+                'expires': cookie.expires
+            })
+
+            if cookie.expires is not None:
+                expires = min(expires, cookie.expires)
+
+        with self._credentials_lock:
+            username = self._credentials['username']
+
+        self._update_logins(lambda logins: logins.__setitem__(self._login_url, {'username': username, 'cookies': cookies, 'expires': expires}))
+
+    def _forget_login(self):
+        self._update_logins(lambda logins: logins.pop(self._login_url, None))
+
+    def _update_logins(self, change):
+        with _logins_lock:
+            self._change_logins(change)
+
+    def _change_logins(self, change):
+        path = credentials_path()
+        logins = load_json(path, {})
+        if not isinstance(logins, dict):
+            logins = {}
+
+        now = time.time()
+        for key in logins.keys():
+            if not isinstance(logins[key], dict) or logins[key].get('expires', 0) <= now:
+                del logins[key]
+
+        change(logins)
+
+        try:
+            save_json(path, logins, 0600)
+        except (IOError, OSError):
+            print 'Could not write the login cache: ' + path
 
     def _login(self):
         data = {}
 
-        if self._username == '':
-            self._username = raw_input('Please provide the username for your upload server (or leave blank if none is required): ')
+        with self._credentials_lock:
+            if self._credentials['username'] is None or self._credentials['username'] == '':
+                self._credentials['username'] = raw_input('Please provide the username for your upload server (or leave blank if none is required): ')
 
-        if self._password == '':
-            self._password = getpass.getpass('Please provide the password for your upload server (or leave blank if none is required): ')
+            if self._credentials['password'] is None or self._credentials['password'] == '':
+                self._credentials['password'] = getpass.getpass('Please provide the password for your upload server (or leave blank if none is required): ')
 
-        if self._username != '':
-            data['username'] = self._username
-        if self._password != '':
-            data['password'] = self._password
+            username = self._credentials['username']
+            password = self._credentials['password']
 
-        r = requests.post(self._login_url,
-            data=json.dumps(data),
-            headers={'Content-Type': 'application/json'},
-            verify=self._verify_ssl
-        )
+        if username != '':
+            data['username'] = username
+        if password != '':
+            data['password'] = password
 
-        self._cookies = r.cookies
+        try:
+            r = with_retries(lambda: self._session.post(self._login_url,
+                data=json.dumps(data),
+                headers={'Content-Type': 'application/json'}
+            ), self._config['upload_retries'])
+        except requests.exceptions.RequestException:
+            raise WrongLoginCredentials('Could not connect to the login server: ' + self._login_url, transient=True)
 
         self._login_response(r)
 
@@ -71,26 +240,249 @@ class Upload(object):
         if r.status_code != 200:
             raise WrongLoginCredentials('Could not log in with the given credentials.')
 
-        self._upload()
+        self._save_login()
+
+    def _is_unauthorized(self, r):
+        return r is not None and not isinstance(r, FileUploadError) and r.status_code in (401, 403)
+
+    def _upload_all(self, artefacts):
+        jobs = min(self._config['jobs'], len(artefacts))
 
-    def _upload(self):
-        if not os.path.exists(self._zip_path):
-            raise FileNotFoundError('Could not find the zip file. Please check if "' + self._zip_path + '" exists.')
+        if jobs <= 1:
+            return [self._upload(artefact, True) for artefact in artefacts]
 
+        pool = ThreadPool(jobs)
         try:
-            zip_file = open(self._zip_path, 'rb')
-        except:
-            raise GeneralError('Something went wrong while opening the zip file. Please try again.')
-
-        r = requests.post(self._upload_url,
-            files={'file': zip_file},
-            cookies=self._cookies,
-            verify=self._verify_ssl
+            # Without a timeout the wait can not be interrupted with Ctrl+C.
+            return pool.map_async(lambda artefact: self._upload(artefact, False), artefacts).get(365 * 24 * 3600)
+        finally:
+            pool.close()
+
+    def _upload(self, artefact, show_progress):
+        # The response of the upload, None if nothing had to be sent or the error.
+        try:
+            if self._config['upload_dedupe'] and self._dedupe(artefact, show_progress):
+                return None
+
+            if self._config['upload_chunk_size'] is None:
+                return with_retries(lambda: self._post_file(artefact, show_progress), self._config['upload_retries'])
+            else:
+                return self._upload_chunks(artefact, show_progress)
+        except requests.exceptions.RequestException:
+            return FileUploadError('Could not connect to the upload server. Please try again.', transient=True)
+        except (IOError, OSError, zipfile.BadZipfile):
+            return FileUploadError('Something went wrong while reading the zip file. Please try again.')
+        except FileUploadError as e:
+            return e
+        except Exception:
+            return FileUploadError(traceback.format_exc())
+
+    def _print(self, msg):
+        with self._output_lock:
+            print msg
+
+    def _url(self, *parts):
+        return self._upload_url.rstrip('/') + '/' + '/'.join(parts)
+
+    def _content_headers(self, artefact, headers):
+        if artefact.digest is not None:
+            headers['X-Content-SHA256'] = artefact.digest
+        return headers
+
+    def _manifest(self, artefact):
+        stat = os.stat(artefact.zip_path)
+        manifest = load_json(manifest_path(artefact.zip_path))
+
+        # Written by the zip command, it only describes the zip file if that did not change since.
+        if manifest is None or manifest.get('size') != stat.st_size or manifest.get('mtime') != int(stat.st_mtime):
+            manifest = {'digest': file_digest(artefact.zip_path, 'sha256'), 'files': None}
+
+        return manifest
+
+    def _dedupe(self, artefact, show_progress):
+        manifest = self._manifest(artefact)
+        artefact.digest = manifest['digest']
+
+        r = with_retries(lambda: self._session.head(self._url(artefact.digest)), self._config['upload_retries'])
+
+        if r.status_code == 200:
+            self._print('The server already has ' + artefact.zip_name + ', nothing to upload.')
+            return True
+
+        if manifest['files'] is None:
+            return False
+
+        files = [{'name': name, 'digest': digest, 'size': size} for name, digest, size in manifest['files']]
+        data = json.dumps({'name': artefact.zip_name, 'digest': artefact.digest, 'files': files})
+
+        r = self._post_manifest(data)
+        if r.status_code != 200:
+            # The server does not know single files, the whole zip file is sent instead.
+            return False
+
+        missing = self._missing(r)
+        if missing is None:
+            return False
+
+        if len(missing) > 0 and not self._upload_blobs(artefact, files, missing, show_progress):
+            return False
+
+        r = self._post_manifest(data)
+        if r.status_code not in (200, 201) or self._missing(r) != []:
+            raise FileUploadError('The server could not assemble ' + artefact.zip_name + ' from the uploaded files. Please try again.\n' + r.text, transient=is_retryable(r))
+
+        self._print('Uploaded %d of %d files of %s, the server had the rest.' % (len(missing), len(files), artefact.zip_name))
+        return True
+
+    def _post_manifest(self, data):
+        return with_retries(lambda: self._session.post(self._url('manifest'),
+            data=data,
+            headers={'Content-Type': 'application/json'}
+        ), self._config['upload_retries'])
+
+    def _missing(self, r):
+        try:
+            missing = r.json()['missing']
+        except (ValueError, KeyError, TypeError):
+            return None
+
+        if not isinstance(missing, list):
+            return None
+
+        return missing
+
+    def _upload_blobs(self, artefact, files, missing, show_progress):
+        names = {}
+        for f in files:
+            names.setdefault(f['digest'], f)
+
+        blobs = [names[digest] for digest in set(missing) if digest in names]
+        progress = Progress(artefact.zip_name, sum([f['size'] for f in blobs]), show=show_progress)
+
+        archive = zipfile.ZipFile(artefact.zip_path, 'r')
+        try:
+            for f in blobs:
+                try:
+                    data = archive.read(f['name'])
+                except NotImplementedError:
+                    # Python 2 can not read bzip2 or lzma entries, those are only sent as a whole.
+                    return False
+
+                r = with_retries(lambda: self._session.put(self._url('blobs', f['digest']),
+                    data=data,
+                    headers={'Content-Type': 'application/octet-stream'}
+                ), self._config['upload_retries'])
+
+                if r.status_code not in (200, 201, 204):
+                    raise FileUploadError('Could not upload ' + f['name'] + ' of ' + artefact.zip_name + ' to the server. Please try again.\n' + r.text, transient=is_retryable(r))
+
+                progress.add(f['size'])
+        finally:
+            archive.close()
+
+        progress.finish()
+        return True
+
+    def _post_file(self, artefact, show_progress):
+        progress = Progress(artefact.zip_name, os.path.getsize(artefact.zip_path), show=show_progress)
+        body = MultipartFile('file', artefact.zip_path, progress)
+
+        try:
+            r = self._session.post(self._upload_url,
+                data=body,
+                headers=self._content_headers(artefact, {'Content-Type': body.content_type})
+            )
+        finally:
+            body.close()
+
+        progress.finish()
+        return r
+
+    def _upload_id(self, artefact, size):
+        stat = os.stat(artefact.zip_path)
+        return hashlib.sha1('%s:%d:%d' % (artefact.zip_name.encode('utf-8'), size, int(stat.st_mtime))).hexdigest()
+
+    def _chunk_request(self, artefact, upload_id, headers, data=''):
+        headers = self._content_headers(artefact, dict(headers))
+        headers['X-Upload-Id'] = upload_id
+        headers['X-Upload-Name'] = artefact.zip_name.encode('utf-8')
+
+        return self._session.put(self._upload_url,
+            data=data,
+            headers=headers
         )
 
-        self._upload_response(r)
+    def _upload_offset(self, artefact, upload_id, size):
+        # Ask the server how much of an earlier, interrupted upload it already has.
+        return with_retries(lambda: self._chunk_request(artefact, upload_id, {'Content-Range': 'bytes */%d' % size}), self._config['upload_retries'])
+
+    def _upload_chunks(self, artefact, show_progress):
+        size = os.path.getsize(artefact.zip_path)
+        chunk_size = self._config['upload_chunk_size'] * 1024 * 1024
+        upload_id = self._upload_id(artefact, size)
+        retries = self._config['upload_retries']
+
+        r = self._upload_offset(artefact, upload_id, size)
+        if r.status_code != 308:
+            return r
+
+        offset = next_offset(r)
+        progress = Progress(artefact.zip_name, size, offset, show=show_progress)
+        attempt = 0
+
+        f = open(artefact.zip_path, 'rb')
+        try:
+            while True:
+                f.seek(offset)
+                chunk = f.read(chunk_size)
+                headers = {'Content-Range': 'bytes %d-%d/%d' % (offset, offset + len(chunk) - 1, size)}
+
+                try:
+                    r = self._chunk_request(artefact, upload_id, headers, chunk)
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                    r = None
+
+                if r is not None and r.status_code == 308 and next_offset(r) > offset:
+                    offset = next_offset(r)
+                    progress.update(offset)
+                    attempt = 0
+                    continue
+
+                if r is not None and r.status_code in (200, 201):
+                    progress.finish()
+                    return r
+
+                if r is not None and r.status_code != 308 and not is_retryable(r):
+                    return r
+
+                if attempt >= retries:
+                    if r is None:
+                        raise FileUploadError('Could not upload ' + artefact.zip_name + ' to the server, the connection failed %d times.' % (attempt + 1), transient=True)
+                    return r
+
+                # Continue from what the server actually received instead of resending blindly.
+                time.sleep(2 ** attempt)
+                attempt += 1
+
+                r = self._upload_offset(artefact, upload_id, size)
+                if r.status_code != 308:
+                    return r
+
+                offset = next_offset(r)
+                progress.update(offset)
+        finally:
+            f.close()
+
+    def _upload_response(self, artefacts, results):
+        errors = []
+        transient = True
+        for artefact, r in zip(artefacts, results):
+            if isinstance(r, FileUploadError):
+                errors.append(artefact.zip_name + ': ' + r.msg)
+                transient = transient and r.transient
+            elif r is not None and r.status_code not in (200, 201):
+                errors.append(artefact.zip_name + ': ' + r.text)
+                transient = transient and is_retryable(r)
 
-    def _upload_response(self, r):
-        if r.status_code != 201:
-            print r.text
-            raise FileUploadError('Could not upload the file to the server. Please try again.')
+        if len(errors) > 0:
+            raise FileUploadError('%d of %d files could not be uploaded to the server:\n\n' % (len(errors), len(artefacts)) + '\n\n'.join(errors), transient=transient)
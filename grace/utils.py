@@ -1,5 +1,7 @@
 import os
 import sys
+import json
+import hashlib
 
 
 def we_are_frozen():
@@ -12,3 +14,62 @@ def get_path():
     if we_are_frozen():
         return os.path.dirname(unicode(sys.executable, encoding))
     return os.path.dirname(unicode(__file__, encoding))
+
+
+def path_key(path):
+    if isinstance(path, str):
+        return path.decode(sys.getfilesystemencoding() or 'utf-8')
+    return path
+
+
+def load_json(path, default=None):
+    try:
+        f = open(path)
+    except IOError:
+        return default
+
+    try:
+        return json.load(f)
+    except ValueError:
+        return default
+    finally:
+        f.close()
+
+
+def save_json(path, data, mode=None):
+    folder = os.path.dirname(path)
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+
+    tmp_path = path + '.tmp'
+    if mode is None:
+        f = open(tmp_path, 'w')
+    else:
+        # Created with the mode right away, e.g. for secrets that nobody else may read at any time.
+        if os.path.lexists(tmp_path):
+            os.remove(tmp_path)
+        f = os.fdopen(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, mode), 'w')
+    try:
+        json.dump(data, f, separators=(',', ':'))
+    finally:
+        f.close()
+
+    replace_file(tmp_path, path)
+
+
+def replace_file(source, dest):
+    if sys.platform.startswith('win32') and os.path.exists(dest):
+        os.remove(dest)
+    os.rename(source, dest)
+
+
+def file_digest(path, algorithm='sha1'):
+    h = hashlib.new(algorithm)
+    f = open(path, 'rb')
+    try:
+        for block in iter(lambda: f.read(65536), ''):
+            h.update(block)
+    finally:
+        f.close()
+
+    return h.hexdigest()
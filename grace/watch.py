@@ -0,0 +1,241 @@
+from config import Config
+from error import Error
+from manifest import stamp_tree
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import time
+
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+EVENT_HEADER = struct.Struct('iIII')
+
+IGNORED_SUFFIXES = ('~', '.swp', '.swx', '.tmp')
+
+
+def _ignored(path):
+    name = os.path.basename(path)
+    return name.startswith('.#') or name.endswith(IGNORED_SUFFIXES)
+
+
+class PollingWatcher(object):
+    def __init__(self, cwd, interval=0.5):
+        self._cwd = cwd
+        self._interval = interval
+        self._stamps = self._snapshot()
+
+    def _snapshot(self):
+        stamps = stamp_tree(os.path.join(self._cwd, 'src'))
+        stamps.update(stamp_tree(os.path.join(self._cwd, 'assets')))
+
+        config_path = os.path.join(self._cwd, 'project.cfg')
+        if os.path.exists(config_path):
+            stamps[config_path] = os.stat(config_path).st_mtime
+
+        return stamps
+
+    def poll(self, timeout=None):
+        while True:
+            time.sleep(self._interval if timeout is None else timeout)
+
+            stamps = self._snapshot()
+            changes = set()
+            for path in set(stamps.keys()) | set(self._stamps.keys()):
+                if stamps.get(path) != self._stamps.get(path):
+                    changes.add(path)
+            self._stamps = stamps
+
+            if len(changes) > 0 or timeout is not None:
+                return changes
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher(object):
+    def __init__(self, cwd):
+        if not sys.platform.startswith('linux'):
+            raise OSError('inotify is only available on linux.')
+
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._fd = self._libc.inotify_init()
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'Could not initialize inotify.')
+
+        self._cwd = cwd
+        self._watches = {}
+
+        self._add_watch(cwd)
+        self._add_tree(os.path.join(cwd, 'src'))
+        self._add_tree(os.path.join(cwd, 'assets'))
+
+    def _add_watch(self, path):
+        encoded = path.encode(sys.getfilesystemencoding() or 'utf-8') if isinstance(path, unicode) else path
+        wd = self._libc.inotify_add_watch(self._fd, encoded, WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), 'Could not watch ' + path)
+
+        self._watches[wd] = path
+
+    def _add_tree(self, folder):
+        if not os.path.isdir(folder):
+            return
+
+        for root, dirs, files in os.walk(folder):
+            try:
+                self._add_watch(root)
+            except OSError as e:
+                # The folder was removed again before it could be watched, its parent reports that.
+                if e.errno not in (errno.ENOENT, errno.ENOTDIR):
+                    raise
+
+    def poll(self, timeout=None):
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if len(readable) == 0:
+            return set()
+
+        data = os.read(self._fd, 65536)
+        changes = set()
+        offset = 0
+
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip('\0')
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                changes.add(os.path.join(self._cwd, 'project.cfg'))
+                continue
+
+            folder = self._watches.get(wd)
+            if folder is None:
+                continue
+
+            path = os.path.join(folder, name) if name else folder
+
+            if folder == self._cwd and os.path.basename(path) not in ('project.cfg', 'src', 'assets'):
+                continue
+
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                self._add_tree(path)
+
+            changes.add(path)
+
+        return changes
+
+    def close(self):
+        os.close(self._fd)
+
+
+class Watch(object):
+    def __init__(self, config, build, debounce=0.2):
+        self._cwd = os.getcwd()
+        self._config = config
+        self._build = build
+        self._debounce = debounce
+
+    def run(self):
+        self._rebuild(None)
+
+        try:
+            watcher = InotifyWatcher(self._cwd)
+        except (OSError, AttributeError):
+            watcher = PollingWatcher(self._cwd)
+
+        print 'Watching for changes, press Ctrl+C to stop.'
+
+        try:
+            while True:
+                changes = watcher.poll()
+
+                while True:
+                    more = watcher.poll(self._debounce)
+                    if len(more) == 0:
+                        break
+                    changes |= more
+
+                changes = [path for path in changes if not _ignored(path)]
+                if len(changes) == 0:
+                    continue
+
+                stages = self._stages_for(changes)
+                if stages is None:
+                    self._reload_config()
+
+                self._rebuild(stages)
+        except KeyboardInterrupt:
+            print '\nStopped watching.'
+        finally:
+            watcher.close()
+
+    def _stages_for(self, paths):
+        stages = set()
+        js_name = self._config['js_name'] + '.js'
+
+        for path in paths:
+            parts = os.path.relpath(path, self._cwd).split(os.sep)
+
+            if parts[0] == 'project.cfg':
+                return None
+            elif parts[0] == 'assets':
+                stages.add('assets')
+            elif parts[0] == 'src':
+                if len(parts) == 1:
+                    return None
+                elif parts[1] == 'javascript' or parts[1] == js_name or parts[1] == 'application.js':
+                    stages.add('javascript')
+                elif parts[1] == 'style':
+                    stages.add('style')
+                elif parts[1] == 'lib':
+                    stages.add('libraries')
+                elif parts[1] == 'index.html':
+                    stages.add('html')
+
+        return stages
+
+    def _reload_config(self):
+        try:
+            config = Config().get_config()
+        except Error as e:
+            print e.msg
+            return
+
+        self._config.update(config)
+
+    def _rebuild(self, stages):
+        if stages is not None and len(stages) == 0:
+            return
+
+        start = time.time()
+        try:
+            if stages is None:
+                self._build.run()
+            else:
+                self._build.run_stages(stages)
+        except Error as e:
+            print e.msg
+            return
+        except Exception as e:
+            print 'Could not build the project: ' + str(e)
+            return
+
+        if stages is None:
+            print 'Built the project in %.2fs.' % (time.time() - start)
+        else:
+            print 'Rebuilt ' + ', '.join(sorted(stages)) + ' in %.2fs.' % (time.time() - start)
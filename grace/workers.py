@@ -0,0 +1,47 @@
+from multiprocessing import Pool
+import sys
+import threading
+
+
+_pool = None
+
+
+def start_workers(jobs):
+    # Forking while other threads run can copy a lock one of them holds into the worker and
+    # deadlock it. The pool is started by the main thread before the stages and tasks start
+    # their threads, and shared by all of them.
+    global _pool
+
+    # Windows spawns the workers by re-importing manage.py, which has no
+    # __main__ guard and would run the task again in every worker.
+    if _pool is not None or jobs <= 1 or sys.platform.startswith('win32'):
+        return
+
+    if not isinstance(threading.current_thread(), threading._MainThread):
+        return
+
+    _pool = Pool(jobs)
+
+
+def stop_workers():
+    global _pool
+    if _pool is None:
+        return
+
+    pool = _pool
+    _pool = None
+    pool.close()
+    pool.join()
+
+
+def has_workers():
+    return _pool is not None
+
+
+def run_work(function, work):
+    # Without a started pool the work runs in the calling thread.
+    if _pool is None or len(work) == 0:
+        return [function(job) for job in work]
+
+    # Without a timeout the wait can not be interrupted with Ctrl+C.
+    return _pool.map_async(function, work, 1).get(365 * 24 * 3600)
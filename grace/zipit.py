@@ -1,6 +1,8 @@
 from error import FileNotWritableError, RemoveFileError, MissingKeyError
+from archive import ZipArchive, available, write_tar
+from sync import sync_file
+from fingerprint import replaced_files
 import os
-import zipfile
 
 
 class Zip(object):
@@ -27,40 +29,92 @@ class Zip(object):
         else:
             raise MissingKeyError('It seems you are trying to zip a project but neither build nor test were specified. I am sorry but I do not know what to do now.')
 
+        dest = os.path.join(self._cwd, 'build', name + '_v' + self._config['version'] + '.zip')
         try:
-            self._zip(name, source, os.path.join(self._cwd, 'build', name + '_v' + self._config['version'] + '.zip'))
+            self._zip(name, source, dest)
 
             if self._zip_path is not None:
-                self._zip(name, source, os.path.join(self._zip_path, name + '_v' + self._config['version'] + '.zip'))
+                self._copy(dest, os.path.join(self._zip_path, name + '_v' + self._config['version'] + '.zip'))
+
+            if self._config['tar_format'] is not None:
+                tar_name = name + '_v' + self._config['version'] + '.' + self._config['tar_format']
+                self._tar(name, source, os.path.join(self._cwd, 'build', tar_name))
+
+                if self._zip_path is not None:
+                    self._copy(os.path.join(self._cwd, 'build', tar_name), os.path.join(self._zip_path, tar_name))
         except:
             raise
 
+    def _files(self, name, source):
+        replaced = replaced_files(source)
+        files = []
+        for root, dirs, filenames in os.walk(source, followlinks=True):
+            for f in filenames:
+                if os.path.join(root, f) in replaced:
+                    continue
+
+                tmpfilename = os.path.join(root, f).split(source)[1][1:]
+                files.append((os.path.join(root, f), os.path.join(name, tmpfilename)))
+
+        return files
+
     def _zip(self, name, source, dest):
+        files = self._files(name, source)
+
+        if not available(self._config['zip_compression']):
+            raise FileNotWritableError('The ' + self._config['zip_compression'] + ' compression is not available, lzma needs the backports.lzma package.')
+
         try:
-            self._cleanup(dest)
+            z = ZipArchive(dest, self._config['jobs'], self._config['zip_compression'], self._config['zip_level'])
+        except (IOError, OSError):
+            raise FileNotWritableError('Could not write to the zip file.')
+
+        previous = self._previous_archive(name, dest)
+        if previous is not None:
+            z.reuse(previous)
+
+        try:
+            z.add_files(files)
+            z.close()
         except:
-            raise
+            z.abort()
+            raise FileNotWritableError('Could not write to the zip file.')
+
+    def _tar(self, name, source, dest):
+        if not available(self._config['tar_format']):
+            raise FileNotWritableError('Could not write the ' + self._config['tar_format'] + ' file, it needs the backports.lzma package.')
 
         try:
-            z = zipfile.ZipFile(dest, 'a', zipfile.ZIP_DEFLATED)
-        except RuntimeError as e:
-            try:
-                z = zipfile.ZipFile(dest, 'a')
-            except:
-                raise
+            write_tar(dest, self._files(name, source), self._config['tar_format'], self._config['zip_level'])
         except:
-            raise
+            raise FileNotWritableError('Could not write the ' + self._config['tar_format'] + ' file.')
 
-        for root, dirs, files in os.walk(source):
-            for f in files:
-                tmpfilename = os.path.join(root, f).split(source)[1][1:]
-                zipfilename = os.path.join(name, tmpfilename)
-                try:
-                    z.write(os.path.join(root, f), zipfilename)
-                except:
-                    raise FileNotWritableError('Could not write to the zip file.')
+    def _previous_archive(self, name, dest):
+        # The archive of the same version or the newest one of an earlier version. The name is
+        # matched as a prefix, a glob would read characters like [ in it as a pattern.
+        folder = os.path.dirname(dest)
+        candidates = []
+        for f in os.listdir(folder):
+            if f.startswith(name + '_v') and f.endswith('.zip') and os.path.isfile(os.path.join(folder, f)):
+                candidates.append(os.path.join(folder, f))
+
+        if os.path.exists(dest) and dest not in candidates:
+            candidates.append(dest)
 
-        z.close()
+        if len(candidates) == 0:
+            return None
+
+        return max(candidates, key=os.path.getmtime)
+
+    def _copy(self, source, dest):
+        # The archive in the build folder is replaced and never written to, a hard link is safe.
+        try:
+            self._cleanup(dest)
+            sync_file(source, dest, link=True)
+        except RemoveFileError:
+            raise
+        except:
+            raise FileNotWritableError('Could not copy the zip file to the zip path.')
 
     def _cleanup(self, path):
 
@@ -32,6 +32,7 @@ setup(
     scripts=['bin/grace'],
     packages=['grace'],
     install_requires=['pyScss', 'argparse', 'setuptools', 'slimit', 'cssmin', 'pyjsdoc', 'requests'],
+    extras_require={'lzma': ['backports.lzma']},
     package_data=package_data,
     keywords='toolchain javascript dizmo js buildtool',
     long_description=open('README.txt').read(),
@@ -0,0 +1,141 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'grace'))
+
+from build import Build
+from config import OPTIONS
+from deploy import Deploy
+from minifycache import MinifyCache
+from sourcemap import minify_marked
+
+SKELETON = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'grace', 'skeleton', 'default')
+
+
+class BuildTest(unittest.TestCase):
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self._tmp = tempfile.mkdtemp()
+        os.chdir(self._tmp)
+
+        # The skeleton libraries are concatenated into the application, as a project with them in src/javascript would.
+        javascript = os.path.join(self._tmp, 'src', 'javascript')
+        os.makedirs(javascript)
+        for name in ['qunit', 'joose']:
+            shutil.copy(os.path.join(SKELETON, 'test', 'lib', name, name + '.js'), javascript)
+
+        self._write(os.path.join(self._tmp, 'src', 'application.js'), '//= require qunit\n//= require joose\nvar app = {};\n')
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+        shutil.rmtree(self._tmp)
+
+    def _write(self, path, data):
+        f = open(path, 'w')
+        try:
+            f.write(data)
+        finally:
+            f.close()
+
+    def _read(self, path):
+        f = open(path)
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    def _build(self, **options):
+        config = dict((key, default) for key, valid, default in OPTIONS)
+        config.update({
+            'name': u'Project',
+            'version': u'0.1',
+            'js_name': u'application',
+            'build_path': os.path.join(self._tmp, 'build', 'Project'),
+            'incremental': False,
+            'minify_cache': False,
+            'jobs': 1
+        })
+        config.update(options)
+        Build(config).run()
+
+        return os.path.join(config['build_path'], 'application.js')
+
+    def test_minify_with_empty_productions(self):
+        self.assertEqual(minify_marked(u'function f(){}\n'), u'\x000\x01function f(){}')
+        self.assertEqual(minify_marked(u'\n'), u'')
+
+    def test_minify_skeleton_libraries_with_source_map(self):
+        path = self._build(minify_js=True, source_map=True)
+
+        self.assertTrue(self._read(path).endswith('\n//# sourceMappingURL=application.js.map\n'))
+
+        source_map = json.loads(self._read(path + '.map'))
+        self.assertEqual(sorted(source_map['sources']), ['src/application.js', 'src/javascript/joose.js', 'src/javascript/qunit.js'])
+        self.assertNotEqual(source_map['mappings'].strip(';'), '')
+
+    def test_source_map_sources_are_found_from_the_map(self):
+        for minify_js, minify_js_per_module in [(False, False), (True, False), (True, True)]:
+            path = self._build(minify_js=minify_js, minify_js_per_module=minify_js_per_module, source_map=True)
+
+            source_map = json.loads(self._read(path + '.map'))
+            for source in source_map['sources']:
+                self.assertTrue(os.path.isfile(os.path.join(os.path.dirname(path), source_map['sourceRoot'] + source)))
+
+    def test_rebuild_keeps_fingerprinted_files(self):
+        style = os.path.join(self._tmp, 'src', 'style')
+        os.makedirs(style)
+        self._write(os.path.join(style, 'main.css'), 'body { color: red; }')
+        self._write(os.path.join(self._tmp, 'src', 'index.html'), '<link rel="stylesheet" href="style/main.css">')
+
+        self._build(fingerprint=True, incremental=True)
+        build_path = os.path.join(self._tmp, 'build', 'Project')
+        mapping = json.loads(self._read(os.path.join(build_path, 'asset-manifest.json')))
+        hashed = os.path.join(build_path, mapping['style/main.css'])
+        os.utime(hashed, (0, 0))
+
+        # Only the style stage runs again, the copy of main.css is neither removed nor written again.
+        self._write(os.path.join(style, 'notes.txt'), 'notes')
+        self._build(fingerprint=True, incremental=True)
+
+        self.assertIn(mapping['style/main.css'], self._read(os.path.join(build_path, 'index.html')))
+        self.assertEqual(os.stat(hashed).st_mtime, 0)
+
+        deployment_path = os.path.join(self._tmp, 'deploy')
+        os.makedirs(deployment_path)
+        config = dict((key, default) for key, valid, default in OPTIONS)
+        config.update({'name': u'Project', 'build': True, 'test': False, 'deployment_path': deployment_path})
+        Deploy(config).run(None)
+
+        deployed = os.path.join(deployment_path, 'Project')
+        self.assertTrue(os.path.isfile(os.path.join(deployed, mapping['style/main.css'])))
+        self.assertTrue(os.path.isfile(os.path.join(deployed, mapping['application.js'])))
+        self.assertFalse(os.path.exists(os.path.join(deployed, 'style', 'main.css')))
+        self.assertFalse(os.path.exists(os.path.join(deployed, 'application.js')))
+
+    def test_prune_only_removes_cache_entries(self):
+        folder = os.path.join(self._tmp, 'cache')
+        cache = MinifyCache(folder, 10)
+        first = cache.key('js', u'first')
+        second = cache.key('js', u'second')
+        cache.put(first, '0123456789')
+        os.utime(os.path.join(folder, first[:2], first), (0, 0))
+        cache.put(second, '0123456789')
+
+        os.makedirs(os.path.join(folder, 'notes'))
+        self._write(os.path.join(folder, 'notes', 'readme.txt'), 'not an entry')
+        self._write(os.path.join(folder, second[:2], 'readme.txt'), 'not an entry')
+
+        cache.prune()
+
+        self.assertIsNone(cache.get(first))
+        self.assertEqual(cache.get(second), '0123456789')
+        self.assertTrue(os.path.exists(os.path.join(folder, 'notes', 'readme.txt')))
+        self.assertTrue(os.path.exists(os.path.join(folder, second[:2], 'readme.txt')))
+
+
+if __name__ == '__main__':
+    unittest.main()
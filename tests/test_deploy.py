@@ -0,0 +1,123 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'grace'))
+
+from deploy import Deploy
+from error import MissingKeyError, TargetError
+from sync import exchange
+from targets import run_targets
+
+
+class DeployTest(unittest.TestCase):
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self._tmp = tempfile.mkdtemp()
+        os.chdir(self._tmp)
+
+        # A test build like the one test_shared_files "symlink" creates.
+        shared = os.path.join(self._tmp, 'build', '.cache', 'test_shared', 'assets')
+        os.makedirs(os.path.join(shared, 'images'))
+        self._write(os.path.join(shared, 'images', 'logo.png'), 'png')
+
+        self._source = os.path.join(self._tmp, 'build', 'Project_a')
+        os.makedirs(self._source)
+        self._write(os.path.join(self._source, 'index.html'), 'html')
+        os.symlink(shared, os.path.join(self._source, 'assets'))
+
+        self._deployment_path = os.path.join(self._tmp, 'deploy')
+        os.makedirs(self._deployment_path)
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+        shutil.rmtree(self._tmp)
+
+    def _write(self, path, data):
+        f = open(path, 'w')
+        try:
+            f.write(data)
+        finally:
+            f.close()
+
+    def _read(self, path):
+        f = open(path)
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    def _deploy(self, mode):
+        Deploy({
+            'name': 'Project',
+            'build': False,
+            'test': True,
+            'deployment_path': self._deployment_path,
+            'deploy_mode': mode,
+            'sync_checksum': False,
+            'jobs': 1,
+            'target_retries': 0
+        }).run('a')
+
+        return os.path.join(self._deployment_path, 'Project_a')
+
+    def _assert_deployed(self, dest):
+        self.assertEqual(self._read(os.path.join(dest, 'index.html')), 'html')
+        self.assertEqual(self._read(os.path.join(dest, 'assets', 'images', 'logo.png')), 'png')
+        self.assertFalse(os.path.islink(os.path.join(dest, 'assets')))
+
+    def test_sync_copies_linked_folders(self):
+        self._assert_deployed(self._deploy('sync'))
+
+    def test_rename_copies_linked_folders(self):
+        self._assert_deployed(self._deploy('rename'))
+
+    def test_symlink_copies_linked_folders(self):
+        self._assert_deployed(self._deploy('symlink'))
+
+    def test_redeploy_replaces_changed_files(self):
+        for mode in ['sync', 'rename', 'symlink']:
+            self._deploy(mode)
+            self._write(os.path.join(self._source, 'index.html'), 'changed ' + mode)
+
+            dest = self._deploy(mode)
+            self.assertEqual(self._read(os.path.join(dest, 'index.html')), 'changed ' + mode)
+            self.assertEqual(self._read(os.path.join(dest, 'assets', 'images', 'logo.png')), 'png')
+
+    def test_rename_swaps_the_deployment(self):
+        dest = self._deploy('rename')
+        old = os.path.join(self._tmp, 'old')
+        os.makedirs(old)
+
+        if not exchange(old, dest):
+            self.skipTest('renameat2 is not available')
+
+        self.assertEqual(os.listdir(dest), [])
+        self.assertEqual(self._read(os.path.join(old, 'index.html')), 'html')
+
+        exchange(old, dest)
+        self._write(os.path.join(self._source, 'index.html'), 'changed')
+        self._deploy('rename')
+
+        self.assertEqual(self._read(os.path.join(dest, 'index.html')), 'changed')
+        self.assertEqual(sorted(os.listdir(self._deployment_path)), ['Project_a'])
+
+    def test_only_transient_errors_are_retried(self):
+        attempts = []
+
+        def deploy(target):
+            attempts.append(target)
+            if target == 'missing':
+                raise MissingKeyError('Could not find deployment path in config file.')
+            if attempts.count(target) == 1:
+                raise IOError('The deployment path is not reachable.')
+
+        self.assertRaises(TargetError, run_targets, 'Deploying to', ['missing', 'offline'], deploy, retries=2, delay=0)
+        self.assertEqual(attempts.count('missing'), 1)
+        self.assertEqual(attempts.count('offline'), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'grace'))
+
+from taskstate import TaskState
+
+
+class TaskStateTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.mkdtemp()
+        self._state_path = os.path.join(self._tmp, 'tasks.json')
+        self._file = os.path.join(self._tmp, 'application.js')
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp)
+
+    def _write(self, path, data):
+        f = open(path, 'w')
+        try:
+            f.write(data)
+        finally:
+            f.close()
+
+    def test_file_changed_when_the_state_was_saved_is_read_again(self):
+        # Written, saved and changed again within the same tick, the size and modification time stay the same.
+        self._write(self._file, 'var a;')
+        os.utime(self._file, (1000, 1000))
+        state = TaskState(self._state_path)
+        before = state.digest([self._file])
+        state.save()
+        os.utime(self._state_path, (1000, 1000))
+
+        self._write(self._file, 'var b;')
+        os.utime(self._file, (1000, 1000))
+
+        self.assertNotEqual(TaskState(self._state_path).digest([self._file]), before)
+
+    def test_file_older_than_the_state_is_not_read_again(self):
+        self._write(self._file, 'var a;')
+        os.utime(self._file, (0, 0))
+        state = TaskState(self._state_path)
+        before = state.digest([self._file])
+        state.save()
+
+        self._write(self._file, 'var b;')
+        os.utime(self._file, (0, 0))
+
+        self.assertEqual(TaskState(self._state_path).digest([self._file]), before)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,206 @@
+import BaseHTTPServer
+import SocketServer
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'grace'))
+
+from config import OPTIONS
+from upload import Upload
+from zipit import Zip
+
+
+class StubServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), StubHandler)
+        self.requests = []
+        self.received = ''
+        self.digests = set()
+        self.interrupt_at = None
+
+
+class StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # A resumable upload server as described in the README for upload_chunk_size and upload_dedupe.
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def _reply(self, status, body='', headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _received(self, status=308):
+        if len(self.server.received) == 0:
+            self._reply(status)
+        else:
+            self._reply(status, headers={'Range': 'bytes=0-%d' % (len(self.server.received) - 1)})
+
+    def do_HEAD(self):
+        self.server.requests.append(('HEAD', self.path, None))
+        self._reply(200 if self.path.rsplit('/', 1)[-1] in self.server.digests else 404)
+
+    def do_POST(self):
+        body = self._body()
+        self.server.requests.append(('POST', self.path, None))
+
+        if self.path.endswith('/login'):
+            self._reply(200, headers={'Set-Cookie': 'session=%s; Path=/' % json.loads(body).get('username', '')})
+        elif self.path.endswith('/manifest'):
+            files = json.loads(body)['files']
+            self._reply(200, json.dumps({'missing': [f['digest'] for f in files if f['digest'] not in self.server.digests]}))
+        else:
+            self._reply(200)
+
+    def do_PUT(self):
+        body = self._body()
+        content_range = self.headers.get('Content-Range')
+        self.server.requests.append(('PUT', self.path, content_range))
+
+        if '/blobs/' in self.path:
+            self.server.digests.add(hashlib.sha256(body).hexdigest())
+            self._reply(201)
+            return
+
+        match = re.match('bytes (\d+)-(\d+)/(\d+)', content_range or '')
+        if match is None:
+            self._received()
+            return
+
+        start, end, total = [int(value) for value in match.groups()]
+        if start == self.server.interrupt_at:
+            # The connection breaks after half of the chunk arrived.
+            self.server.interrupt_at = None
+            self.server.received = self.server.received[:start] + body[:len(body) // 2]
+            self.close_connection = 1
+            return
+
+        self.server.received = self.server.received[:start] + body
+        self._received(201 if len(self.server.received) == total else 308)
+
+
+class UploadTest(unittest.TestCase):
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self._home = os.environ.get('HOME')
+        self._tmp = tempfile.mkdtemp()
+        os.chdir(self._tmp)
+        os.environ['HOME'] = self._tmp
+
+        os.makedirs(os.path.join(self._tmp, 'build'))
+        self._data = os.urandom(2 * 1024 * 1024 + 1000)
+        f = open(os.path.join(self._tmp, 'build', 'Project_v0.1.zip'), 'wb')
+        try:
+            f.write(self._data)
+        finally:
+            f.close()
+
+        self._server = StubServer()
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def tearDown(self):
+        self._server.shutdown()
+        self._server.server_close()
+        os.chdir(self._cwd)
+        if self._home is None:
+            del os.environ['HOME']
+        else:
+            os.environ['HOME'] = self._home
+        shutil.rmtree(self._tmp)
+
+    def _upload(self, **options):
+        url = 'http://127.0.0.1:%d' % self._server.server_address[1]
+        config = dict((key, default) for key, valid, default in OPTIONS)
+        config.update({
+            'name': u'Project',
+            'version': u'0.1',
+            'urls': {'upload': url + '/upload', 'login': url + '/login'},
+            'credentials': {'username': u'user', 'password': u'secret'},
+            'upload_retries': 1,
+            'upload_cache_login': False,
+            'jobs': 1
+        })
+        config.update(options)
+        Upload(config).run()
+
+    def _sent(self, method):
+        return [request for request in self._server.requests if request[0] == method]
+
+    def test_interrupted_upload_resumes(self):
+        self._server.interrupt_at = 1024 * 1024
+        self._upload(upload_chunk_size=1)
+
+        self.assertEqual(self._server.received, self._data)
+
+        # After the break it asks for the state and continues with what is missing, nothing is sent twice.
+        total = len(self._data)
+        ranges = [content_range for method, path, content_range in self._sent('PUT')]
+        self.assertEqual(ranges, [
+            'bytes */%d' % total,
+            'bytes 0-1048575/%d' % total,
+            'bytes 1048576-2097151/%d' % total,
+            'bytes */%d' % total,
+            'bytes 1572864-%d/%d' % (total - 1, total)
+        ])
+
+    def test_upload_skipped_when_the_server_has_the_digest(self):
+        self._server.digests.add(hashlib.sha256(self._data).hexdigest())
+        self._upload(upload_dedupe=True)
+
+        self.assertEqual(self._sent('HEAD'), [('HEAD', '/upload/' + hashlib.sha256(self._data).hexdigest(), None)])
+        self.assertEqual(self._sent('PUT'), [])
+        self.assertEqual(self._sent('POST'), [('POST', '/login', None)])
+
+    def test_upload_sends_only_the_missing_files(self):
+        build_path = os.path.join(self._tmp, 'build', 'Project')
+        os.makedirs(build_path)
+        for name, data in [('index.html', 'html'), ('application.js', 'js')]:
+            f = open(os.path.join(build_path, name), 'w')
+            try:
+                f.write(data)
+            finally:
+                f.close()
+
+        config = dict((key, default) for key, valid, default in OPTIONS)
+        config.update({'name': u'Project', 'version': u'0.1', 'build': True, 'test': False, 'build_path': build_path, 'jobs': 1})
+        Zip(config).run(None)
+
+        self._server.digests.add(hashlib.sha256('html').hexdigest())
+        self._upload(upload_dedupe=True)
+
+        self.assertEqual([path for method, path, content_range in self._sent('PUT')], ['/upload/blobs/' + hashlib.sha256('js').hexdigest()])
+        self.assertEqual([path for method, path, content_range in self._sent('POST')], ['/login', '/upload/manifest', '/upload/manifest'])
+
+    def test_cached_login_without_username(self):
+        self._server.digests.add(hashlib.sha256(self._data).hexdigest())
+        self._upload(upload_dedupe=True, upload_cache_login=True)
+
+        # No username is configured now, the cached login of the same server is used instead of asking.
+        self._upload(upload_dedupe=True, upload_cache_login=True, credentials={})
+        self.assertEqual(self._sent('POST'), [('POST', '/login', None)])
+
+        # Another username does not use the cached login of the first one.
+        self._upload(upload_dedupe=True, upload_cache_login=True, credentials={'username': u'other', 'password': u'secret'})
+        self.assertEqual(self._sent('POST'), [('POST', '/login', None), ('POST', '/login', None)])
+
+
+if __name__ == '__main__':
+    unittest.main()